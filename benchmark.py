@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+nespdf benchmark suite: build cost per build option and display pipeline cost per profile.
+- build: best-of-N build time, output size and PDF object count for each entry of BUILD_MATRIX.
+- renderer: plays mario.nes for --frames frames in node (the PDF's own OpenAction script with stub form fields, one
+  emulated frame per tick, Start pressed at frame 30, Right held from frame 200), records every framebuffer and the
+  screen text the JS renderer wrote, then times reference_renderer.py over the framebuffers and counts rows changed per
+  frame and rows where it disagrees with the JS output. Skipped when node is not on PATH.
+Run: python benchmark.py [--frames N] [--repeat N] [--record frames.fb] [--save results.json] [--baseline results.json]
+- release: builds --release --no-minify with each renderer and checks that the OpenAction script has no debug code
+  left (DEBUG_MARKERS).
+The run fails (exit 1) when a release script has debug code, and with --baseline when a time or size grew more than
+--tolerance, or the JS output differs.
+"""
+from contextlib import redirect_stdout
+import argparse
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import build_pdf
+import reference_renderer
+
+BUILD_MATRIX = [
+    ("default", []),
+    ("--no-compress", ["--no-compress"]),
+    ("--object-streams", ["--object-streams"]),
+    ("--linearize", ["--linearize"]),
+    ("--profile 64x60", ["--profile", "64x60"]),
+    ("--profile 256x240", ["--profile", "256x240"]),
+    ("--band 8", ["--band", "8"]),
+    ("--field-budget 16", ["--field-budget", "16"]),
+    ("--rom-encoding hex", ["--rom-encoding", "hex"]),
+    ("--renderer legacy", ["--renderer", "legacy"]),
+    ("--instrument", ["--instrument"]),
+    ("--release", ["--release"]),
+    ("--no-minify", ["--no-minify"]),
+]
+
+# Text that must not appear in a --release script: debug field names and lines tagged for removal
+DEBUG_MARKERS = ("debug_", "//DEBUG", "debugField2")
+
+# node script: argv pdf frames fb_out text_out. Runs the PDF's OpenAction script against stub fields and a fake clock
+# (like a viewer with app.setInterval) and appends each framebuffer (Uint32 LE) and each screen (JSON rows) per tick.
+RECORDER_JS = r"""
+const fs = require("fs"), vm = require("vm"), zlib = require("zlib");
+const [pdfPath, frameCount, fbOut, textOut] = process.argv.slice(2);
+const pdf = fs.readFileSync(pdfPath), txt = pdf.toString("latin1");
+const ref = /\/OpenAction << \/JS (\d+) 0 R/.exec(txt)[1];
+const m = new RegExp("(^|\\n)" + ref + " 0 obj\\s*<<([\\s\\S]*?)>>\\s*stream\\r?\\n").exec(txt);
+let src = pdf.subarray(m.index + m[0].length, m.index + m[0].length + +/\/Length (\d+)/.exec(m[2])[1]);
+if (/FlateDecode/.test(m[2])) src = zlib.inflateSync(src);
+const fields = {}, timers = [];
+const ctx = { getField: (n) => fields[n] || (fields[n] = { value: "" }) };
+ctx.app = { setInterval: (s) => { timers.push(s); }, setTimeout: (s) => { timers.push(s); }, alert: (s) => { throw new Error(s); } };
+ctx.globalThis = ctx;
+vm.createContext(ctx);
+vm.runInContext("(function(){\n" + src.toString("latin1") + "\n}).call(globalThis)", ctx);
+for (const t of timers.splice(0)) if (typeof t === "string") vm.runInContext(t, ctx);
+ctx.__now = 1e6;
+vm.runInContext("Date.now = function() { return globalThis.__now; }", ctx);
+const screen = () => { const rows = []; for (let i = 0; ("field_" + i) in fields; i++) rows.push(...String(fields["field_" + i].value).split("\r")); return rows; };
+const fb = fs.openSync(fbOut, "w"), text = fs.openSync(textOut, "w");
+for (let i = 0; i < +frameCount; i++) {
+  if (i === 30) vm.runInContext("app.nespdf_keyDown(jsnes.Controller.BUTTON_START)", ctx);
+  if (i === 36) vm.runInContext("app.nespdf_keyUp(jsnes.Controller.BUTTON_START)", ctx);
+  if (i === 200) vm.runInContext("app.nespdf_keyDown(jsnes.Controller.BUTTON_RIGHT)", ctx);
+  ctx.__now += 1000 / 60;
+  vm.runInContext("app.nespdf_tick()", ctx);
+  fs.writeSync(fb, Buffer.from(Uint32Array.from(ctx.app.nespdf_nes.ppu.buffer).buffer));
+  fs.writeSync(text, JSON.stringify(screen()) + "\n");
+}
+"""
+
+
+def run_build(argv):
+    """Run build_pdf.main(argv) quietly; returns seconds."""
+    t0 = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        build_pdf.main(argv)
+    return time.perf_counter() - t0
+
+
+def count_objects(path):
+    """Top-level indirect objects plus the objects packed in object streams."""
+    with open(path, "rb") as f:
+        data = f.read()
+    top = len(set(re.findall(rb"(?:^|\n)(\d+) 0 obj\b", data)))
+    return top + sum(int(n) for n in re.findall(rb"/Type /ObjStm /N (\d+)", data))
+
+
+def openaction_script(path):
+    """The document-open JavaScript of a PDF written without object streams, decompressed."""
+    with open(path, "rb") as f:
+        data = f.read()
+    ref = re.search(rb"/OpenAction << /JS (\d+) 0 R", data).group(1)
+    m = re.search(rb"(?:^|\n)" + ref + rb" 0 obj\s*<<(.*?)>>\s*stream\r?\n", data, re.S)
+    length = int(re.search(rb"/Length (\d+)", m.group(1)).group(1))
+    body = data[m.end() : m.end() + length]
+    return (zlib.decompress(body) if b"/FlateDecode" in m.group(1) else body).decode("latin-1")
+
+
+def check_release(tmp):
+    """Debug markers left in --release scripts, per renderer."""
+    results = {}
+    print("\n== release (--release --no-minify) ==")
+    for renderer in build_pdf.RENDERERS:
+        out = os.path.join(tmp, "release.pdf")
+        run_build(["--release", "--no-minify", "--renderer", renderer, "--no-cache", "-o", out])
+        script = openaction_script(out)
+        results[renderer] = [marker for marker in DEBUG_MARKERS if marker in script]
+        print(f"{renderer:<10}{'debug code left: ' + ', '.join(results[renderer]) if results[renderer] else 'ok'}")
+    return results
+
+
+def bench_builds(tmp, repeat):
+    results = {}
+    print(f"== build (best of {repeat}, no cache) ==")
+    print(f"{'options':<22}{'ms':>9}{'bytes':>10}{'objects':>9}")
+    for name, options in BUILD_MATRIX:
+        out = os.path.join(tmp, "build.pdf")
+        seconds = min(run_build(options + ["--no-cache", "-o", out]) for _ in range(repeat))
+        results[name] = {"ms": seconds * 1000, "bytes": os.path.getsize(out), "objects": count_objects(out)}
+        r = results[name]
+        print(f"{name:<22}{r['ms']:>9.1f}{r['bytes']:>10}{r['objects']:>9}")
+    return results
+
+
+def record(tmp, profile, frames):
+    """Framebuffers and JS screens for the first frames of a --profile build (see RECORDER_JS)."""
+    pdf, script = os.path.join(tmp, "rec.pdf"), os.path.join(tmp, "recorder.js")
+    fb_path, text_path = os.path.join(tmp, f"{profile}.fb"), os.path.join(tmp, f"{profile}.jsonl")
+    run_build(["--profile", profile, "--no-cache", "-o", pdf])
+    with open(script, "w", encoding="utf-8") as f:
+        f.write(RECORDER_JS)
+    subprocess.run(["node", script, pdf, str(frames), fb_path, text_path], check=True)
+    with open(text_path, "r", encoding="utf-8") as f:
+        screens = [json.loads(line) for line in f]
+    return fb_path, screens
+
+
+def bench_renderer(tmp, frames, record_path=None):
+    results = {}
+    impls = ["python"] + (["numpy"] if reference_renderer.np is not None else [])
+    print(f"\n== renderer ({frames} frames; reference_renderer.py, JS output recorded in node) ==")
+    print(f"{'profile':<10}" + "".join(f"{impl + ' ms/frame':>18}" for impl in impls) + f"{'conv/frame':>12}{'written/frame':>15}{'JS rows differing':>19}")
+    for profile in sorted(build_pdf.PROFILES, key=lambda k: build_pdf.PROFILES[k]["block"], reverse=True):
+        fb_path, screens = record(tmp, profile, frames)
+        if record_path and profile == build_pdf.DEFAULT_PROFILE:
+            shutil.copyfile(fb_path, record_path)
+        fbs = reference_renderer.read_frames(fb_path)
+        layout = build_pdf.profile_layout(profile)
+        r = {}
+        for impl in impls:
+            t0 = time.perf_counter()
+            rendered, stats = reference_renderer.render_frames(fbs, layout, use_numpy=(impl == "numpy"))
+            r[impl + "_ms"] = (time.perf_counter() - t0) * 1000 / len(fbs)
+        r["rows_converted"] = sum(stats["rows_converted"]) / len(fbs)
+        r["rows_written"] = sum(stats["rows_written"]) / len(fbs)
+        r["js_rows_differing"] = sum(a != b for ours, js in zip(rendered, screens) for a, b in zip(ours, js))
+        results[profile] = r
+        print(f"{profile:<10}" + "".join(f"{r[impl + '_ms']:>18.2f}" for impl in impls)
+              + f"{r['rows_converted']:>12.1f}{r['rows_written']:>15.1f}{r['js_rows_differing']:>19}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regressions against a saved run: times and sizes more than tolerance above the baseline, any JS mismatch."""
+    problems = []
+    for section, metrics in (("build", ("ms", "bytes")), ("renderer", ("python_ms", "numpy_ms"))):
+        for name, r in results.get(section, {}).items():
+            old = baseline.get(section, {}).get(name, {})
+            for key in metrics:
+                if key in r and key in old and r[key] > old[key] * (1 + tolerance):
+                    problems.append(f"{section} {name} {key}: {old[key]:.1f} -> {r[key]:.1f}")
+    for name, r in results.get("renderer", {}).items():
+        if r["js_rows_differing"]:
+            problems.append(f"renderer {name}: {r['js_rows_differing']} rows differ from the JS renderer")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark nespdf builds and the display pipeline.")
+    parser.add_argument("--frames", type=int, default=300, help="frames to record per profile (default %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3, help="builds per option, best is reported (default %(default)s)")
+    parser.add_argument("--record", metavar="PATH", help=f"also keep the {build_pdf.DEFAULT_PROFILE} framebuffer dump (for reference_renderer.py)")
+    parser.add_argument("--save", metavar="PATH", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with results saved by --save and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed growth against --baseline (default %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        results["build"] = bench_builds(tmp, args.repeat)
+        results["release"] = check_release(tmp)
+        if shutil.which("node"):
+            results["renderer"] = bench_renderer(tmp, args.frames, args.record)
+        else:
+            print("\nnode not found: renderer benchmark skipped")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for p in problems:
+            print("REGRESSION", p)
+        print(f"\n{len(problems)} regression(s) against {args.baseline}")
+        sys.exit(1 if problems else 0)
+    if any(results["release"].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
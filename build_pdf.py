@@ -6,77 +6,313 @@ form fields for display (like pdftris). Run: python build_pdf.py
 Requires jsnes.min.js and mario.nes in the same directory.
 """
 from base64 import b64encode
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import reduce
+from math import gcd
+import argparse
+import hashlib
+import json
 import os
 import re
+import shutil
 import sys
+import time
+import zlib
 
-# --- Layout constants (match PDF object refs below) ---
-SCRIPT_MAIN_ID = 42
-PAGE_ID = 16
-ANNOTS_ID = 21
-FIRST_ROW_ID = 50
-NUM_ROWS = 120
-FIRST_BTN_ID = 170
-FIRST_BTN_SCRIPT_ID = 179  # 9 scripts 179..187 (buttons 170..178)
-# Temporary debug: 5 text fields (debug_0..debug_4) top-right. debug_0=main script status, debug_1=Run/ROM, debug_2=frame count, debug_3=last button clicked. Remove DEBUG_* and debugLog/field_list+make_text_field for debug_* to disable.
-DEBUG_FIELD_IDS = list(range(188, 193))
+# --- Layout ---
+# PDF object numbers are not hand-numbered: assign_object_ids() hands them out in file order once the number of
+# screen fields is known (it depends on --band).
+# Temporary debug: 5 text fields (debug_0..debug_4) top-right. debug_0=main script status, debug_1=Run/ROM, debug_2=frame count, debug_3=last button clicked. --release leaves them out, along with debugLog (//DEBUG lines) and the test pattern.
 NUM_DEBUG_FIELDS = 5
+# --instrument adds debug_5 (emulation / conversion time) and debug_6 (field writes), see PROFILER_SCRIPT
+PROFILER_DEBUG_FIELDS = 2
+# Display rows per screen text field (--band). 1 = one single-line field per row; N > 1 packs N rows into one
+# multiline field so a full-screen update costs ceil(DISPLAY_ROWS / N) field.value assignments.
+ROW_BAND = 1
 
-# Screen: 128x120 chars (2x scale from 256x240)
-DISPLAY_COLS = 128
-DISPLAY_ROWS = 120
+# Field-write budget (--field-budget N, lut renderer): at most N screen fields are written per displayed frame, the
+# rest stay dirty for the next ones. 0 = no limit.
+FIELD_BUDGET = 0
+
+# Frame pacing defaults (--fps, --max-frameskip): emulated frames per second and extra frames run per tick to catch up
+TARGET_FPS = 60
+MAX_FRAMESKIP = 4
+
+# Display profiles (--profile). Each cell averages a block x block square of the 256x240 NES picture, so the grid is
+# (256 / block) x (240 / block); block must be a power of two. The grid always fills the SCREEN_W x SCREEN_H box, so
+# char width, row height and font size follow from it. ramp is (threshold, glyph) pairs, brightest first: a cell whose
+# average luminance (0..255) is above the threshold gets the glyph, the last entry (threshold None) is the fallback.
+GLYPH_RAMP = [(200, "_"), (150, ":"), (100, "?"), (50, "/"), (25, "b"), (None, "#")]
+PROFILES = {
+    "64x60": {"block": 4, "ramp": [(224, "_"), (192, "."), (160, ":"), (128, "?"), (96, "/"), (64, "b"), (32, "%"), (None, "#")]},
+    "128x120": {"block": 2, "ramp": GLYPH_RAMP},
+    "256x240": {"block": 1, "ramp": GLYPH_RAMP},
+}
+DEFAULT_PROFILE = "128x120"
+
+# Build cache (--cache-dir, --cache-size, --no-cache): directory next to this script and its size cap in MB
+CACHE_DIR = ".nespdf-cache"
+CACHE_MAX_MB = 64
 
 # --- Glue script (runs inside PDF after jsnes is loaded) ---
 # Display logic follows DoomPDF: globalThis.getField + ASCII-only chars (same-width in Chrome text fields)
-# ROM base64 is built in multiple lines to avoid single-line length limits in PDF JS parser
+# ROM text (base64 or hex, see ROM_DECODERS) is built in multiple lines to avoid single-line length limits in PDF JS parser
 GLUE_SCRIPT = r"""
-var romBase64 = "";
+var hasApp = typeof app !== "undefined";
+var romData = "";
 ROM_CHUNKS_PLACEHOLDER
-var DISPLAY_ROWS = 120;
-var DISPLAY_COLS = 128;
+var DISPLAY_ROWS = DISPLAY_ROWS_VALUE;
+var DISPLAY_COLS = DISPLAY_COLS_VALUE;
+var ROW_BAND = ROW_BAND_VALUE;
+var NUM_FIELDS = Math.ceil(DISPLAY_ROWS / ROW_BAND);
 function getField(name) {
   if (typeof globalThis !== "undefined" && typeof globalThis.getField === "function") return globalThis.getField(name);
   if (typeof this !== "undefined" && typeof this.getField === "function") return this.getField(name);
   return null;
 }
-function debugLog(msg, slot) { try { var f = getField("debug_" + (slot !== undefined ? slot : 0)); if (f && "value" in f) f.value = String(msg); } catch (e) {} }
-debugLog("script start");
+function debugLog(msg, slot) { try { var f = getField("debug_" + (slot !== undefined ? slot : 0)); if (f && "value" in f) f.value = String(msg); } catch (e) {} } //DEBUG
+function debugLog() {} //RELEASE
+debugLog("script start"); //DEBUG
+PROFILER_PLACEHOLDER
 var screenFields = [];
-for (var r = 0; r < DISPLAY_ROWS; r++) { try { var f = getField("field_" + r); screenFields[r] = (f && "value" in f) ? f : null; } catch (e) { screenFields[r] = null; } }
-var debugField2 = null;
-try { var f = getField("debug_2"); debugField2 = (f && "value" in f) ? f : null; } catch (e) {}
+for (var r = 0; r < NUM_FIELDS; r++) { try { var f = getField("field_" + r); screenFields[r] = (f && "value" in f) ? f : null; } catch (e) { screenFields[r] = null; } }
+// Screen field b shows display rows b*ROW_BAND .. b*ROW_BAND+ROW_BAND-1, one per line
+function writeBand(fields, rows, b, getF) {
+  var t0 = profNow(); //PROF
+  var v = (ROW_BAND === 1) ? rows[b] : rows.slice(b * ROW_BAND, b * ROW_BAND + ROW_BAND).join("\r");
+  try { var f = fields[b] || (getF && getF("field_" + b)); if (f && "value" in f) f.value = v; } catch (e) {}
+  profWriteMs += profNow() - t0; profWrites++; //PROF
+}
+var debugField2 = null; //DEBUG
+try { var f = getField("debug_2"); debugField2 = (f && "value" in f) ? f : null; } catch (e) {} //DEBUG
+TEST_PATTERN_PLACEHOLDER
+var rowCache = [];
+for (var r = 0; r < DISPLAY_ROWS; r++) rowCache[r] = "";
+RENDERER_PLACEHOLDER
+// Frame pacing: tick() runs as many nes.frame() calls as wall-clock time asks for (at most 1 + MAX_FRAMESKIP) and only
+// the last one of a batch reaches onFrame. The display is held back while onFrame is slow (see tick).
+var TARGET_FPS = TARGET_FPS_VALUE;
+var MAX_FRAMESKIP = MAX_FRAMESKIP_VALUE;
+var FRAME_MS = 1000 / TARGET_FPS;
+var TICK_MS = Math.max(1, Math.round(FRAME_MS));
+var skipRender = false;
+var renderMs = 0;
+var firstFrameShown = false;
+function presentFrame(fb) {
+  if (skipRender) return;
+  var t0 = Date.now();
+  var p0 = profNow(); profWriteMs = 0; profWrites = 0; //PROF
+  onFrame(fb);
+  profDrawMs = profNow() - p0; //PROF
+  renderMs = renderMs * 0.75 + (Date.now() - t0) * 0.25;
+  // Time to first frame, from the start of the document script (openTime, set before jsnes loads)
+  if (!firstFrameShown) { firstFrameShown = true; debugLog("first frame " + (Date.now() - openTime) + "ms (rom " + romDecodeMs + "ms)", 0); } //DEBUG
+}
+var nes = new jsnes.NES({ onFrame: presentFrame, onAudioSample: function() {} });
+debugLog("jsnes ok"); //DEBUG
+function bytesToString(b) {
+  var s = "", CH = 8192;
+  for (var i = 0; i < b.length; i += CH) s += String.fromCharCode.apply(null, b.subarray ? b.subarray(i, i + CH) : b.slice(i, i + CH));
+  return s;
+}
+function toBinaryString(x) {
+  if (typeof x === "string") return x;
+  if (x && typeof x.length === "number") { var b = (typeof Uint8Array !== "undefined") ? new Uint8Array(x.length) : []; for (var i = 0; i < x.length; i++) b[i] = (x[i] != null ? x[i] : 0) & 255; return bytesToString(b); }
+  return "";
+}
+ROM_DECODER_PLACEHOLDER
+var romStr = "", romDecodeMs = 0, romOk = false;
+var nesHeader = String.fromCharCode(0x4e, 0x45, 0x53, 0x1a);
+function loadRomData(data) {
+  romStr = "";
+  var t0 = Date.now();
+  try { romStr = decodeRom(data); } catch (e) {}
+  romDecodeMs = Date.now() - t0;
+  romOk = (romStr.length >= 16 && romStr.indexOf(nesHeader) === 0);
+  if (!romOk) debugLog("rom bad len=" + romStr.length + " h=" + (romStr.length>=4 ? [romStr.charCodeAt(0),romStr.charCodeAt(1),romStr.charCodeAt(2),romStr.charCodeAt(3)].join(",") : "?"), 4); //DEBUG
+}
+// Cartridge PDFs embed no ROM here: the ROM-picker buttons carry one each (see selectRom)
+if (romData) loadRomData(romData);
+romData = "";
+var running = false;
+var frameCount = 0;
+var keysDown = [];
+for (var i = 0; i < 8; i++) keysDown[i] = false;
+function toggleKey(btn) {
+  var k = (hasApp && app.nespdf_keysDown) ? app.nespdf_keysDown : keysDown;
+  if (k[btn]) { keyUp(btn); k[btn] = false; }
+  else { keyDown(btn); k[btn] = true; }
+}
+function runOneFrame() {
+  var n = (hasApp && app.nespdf_nes) ? app.nespdf_nes : nes;
+  var p0 = profNow(); //PROF
+  if (n && typeof n.frame === "function") { try { n.frame(); } catch(e) {} }
+  profEndFrame(profNow() - p0); //PROF
+}
+var lastTickTime = 0, frameDebt = 0, nextShowTime = 0, emuFrames = 0, skippedFrames = 0;
+function tick() {
+  if (hasApp && app.nespdf_running === false) return;
+  if (!running && (typeof app === "undefined" || app.nespdf_running !== true)) return;
+  var now = Date.now();
+  var due = lastTickTime ? (now - lastTickTime) / FRAME_MS + frameDebt : 1;
+  lastTickTime = now;
+  var n = Math.floor(due);
+  frameDebt = due - n;
+  // Cap catch-up: beyond MAX_FRAMESKIP the backlog is dropped (emulation slows down instead of spiralling)
+  if (n > MAX_FRAMESKIP + 1) { skippedFrames += n - MAX_FRAMESKIP - 1; n = MAX_FRAMESKIP + 1; frameDebt = 0; }
+  // Back off the display rate while field writes are slow: keep onFrame to about half of wall time
+  var show = now >= nextShowTime;
+  for (var i = 0; i < n; i++) {
+    skipRender = !(show && i === n - 1);
+    runOneFrame();
+  }
+  skipRender = false;
+  emuFrames += n;
+  if (show && n > 0) nextShowTime = now + renderMs * 2;
+  if (n > 0 && emuFrames % 60 < n) debugLog("emu:" + emuFrames + " drop:" + skippedFrames + " draw:" + Math.round(renderMs) + "ms", 4); //DEBUG
+  if (n > 0 && emuFrames % 60 < n) profShow(); //PROF
+  if (hasApp && app.nespdf_useInterval) return;
+  if (hasApp && app.setTimeout) app.setTimeout("app.nespdf_tick()", TICK_MS);
+  else if (typeof setTimeout !== "undefined") setTimeout(tick, TICK_MS);
+}
+var intervalOn = false;
+function startEmulator() {
+  debugLog("run clicked", 1); //DEBUG
+  if (running) return;
+  running = true;
+  if (hasApp) app.nespdf_running = true;
+  if (!romOk) { debugLog(romStr ? "rom invalid" : "pick a ROM", 1); running = false; if (hasApp) app.nespdf_running = false; return; }
+  try { nes.loadROM(romStr); debugLog("rom ok", 1); } catch(e) { debugLog("rom err:" + e, 1); running = false; if (hasApp) app.nespdf_running = false; return; }
+  if (hasApp) { app.nespdf_tick = tick; app.nespdf_nes = nes; app.nespdf_runOneFrame = runOneFrame; app.nespdf_useInterval = intervalOn; }
+  for (var i = 0; i < 5; i++) runOneFrame();
+  // Restart after an invalid cartridge pick: the interval from the first start is still installed
+  if (intervalOn) return;
+  if (hasApp && app.setInterval) { app.setInterval("app.nespdf_tick()", TICK_MS); app.nespdf_useInterval = intervalOn = true; debugLog("interval on", 1); }
+  else if (hasApp && app.setTimeout) { app.setTimeout("app.nespdf_tick()", TICK_MS); debugLog("timeout on", 1); }
+  else if (typeof setInterval !== "undefined") { setInterval(tick, TICK_MS); intervalOn = true; if (hasApp) app.nespdf_useInterval = true; debugLog("interval on", 1); }
+  else if (typeof setTimeout !== "undefined") { setTimeout(tick, TICK_MS); debugLog("timeout on", 1); }
+  else { running = false; if (hasApp) app.nespdf_running = false; debugLog("no timer", 1); return; }
+}
+// ROM-picker button script: selectRom(index, name, ROM text). The ROM is decoded only now, and the previous emulator
+// (ROM copy, mapper, memories) is dropped before decoding so only one cartridge is held at a time.
+function selectRom(index, name, data) {
+  nes = null;
+  if (hasApp) app.nespdf_nes = null;
+  openTime = Date.now();
+  firstFrameShown = false;
+  loadRomData(data);
+  nes = new jsnes.NES({ onFrame: presentFrame, onAudioSample: function() {} });
+  var k = (hasApp && app.nespdf_keysDown) ? app.nespdf_keysDown : keysDown;
+  for (var i = 0; i < 8; i++) k[i] = false;
+  if (hasApp) app.nespdf_nes = nes;
+  if (typeof globalThis !== "undefined") globalThis.nes = nes;
+  debugLog("rom " + index + ": " + name, 3); //DEBUG
+  if (!running) { startEmulator(); return; }
+  if (!romOk) { running = false; if (hasApp) app.nespdf_running = false; debugLog("rom invalid", 1); return; }
+  try { nes.loadROM(romStr); debugLog("rom ok", 1); } catch(e) { debugLog("rom err:" + e, 1); }
+  lastTickTime = 0; frameDebt = 0;
+}
+if (typeof setTimeout !== "undefined") setTimeout(startEmulator, 350); else if (hasApp && app.setTimeout) app.setTimeout("startEmulator()", 350); else startEmulator();
+// Shared button handler: each button's action is pressButton(index); BUTTON_KEYS (from BUTTONS) holds the jsnes
+// Controller button it toggles, -1 for Run
+var BUTTON_KEYS = BUTTON_KEYS_VALUE;
+var BUTTON_LABELS = BUTTON_LABELS_VALUE;
+function pressButton(i) {
+  debugLog(BUTTON_LABELS[i], 3); //DEBUG
+  if (BUTTON_KEYS[i] < 0) startEmulator(); else toggleKey(BUTTON_KEYS[i]);
+}
+function keyDown(btn) { var n = (hasApp && app.nespdf_nes) ? app.nespdf_nes : nes; try { if (n) n.buttonDown(1, btn); } catch(e) {} }
+function keyUp(btn) { var n = (hasApp && app.nespdf_nes) ? app.nespdf_nes : nes; try { if (n) n.buttonUp(1, btn); } catch(e) {} }
+if (typeof globalThis !== "undefined") { globalThis.startEmulator = startEmulator; globalThis.keyDown = keyDown; globalThis.keyUp = keyUp; globalThis.toggleKey = toggleKey; globalThis.selectRom = selectRom; globalThis.pressButton = pressButton; globalThis.debugLog = debugLog; globalThis.tick = tick; globalThis.nes = nes; if (typeof jsnes !== "undefined") globalThis.jsnes = jsnes; }
+if (hasApp) app.nespdf_debugField2 = debugField2; //DEBUG
+if (hasApp) { app.nespdf_tick = tick; app.startEmulator = startEmulator; app.nespdf_keyDown = keyDown; app.nespdf_keyUp = keyUp; app.nespdf_toggleKey = toggleKey; app.nespdf_selectRom = selectRom; app.nespdf_press = pressButton; app.nespdf_keysDown = keysDown; app.nespdf_screenFields = screenFields; app.nespdf_rowCache = rowCache; app.nespdf_getField = getField; app.nespdf_debugLog = debugLog; }
+"""
+
+# Test pattern shown until the first frame; replaces TEST_PATTERN_PLACEHOLDER (left out with --release)
+TEST_PATTERN_SCRIPT = r"""
 function drawTestPattern() {
-  var cols = DISPLAY_COLS;
+  var cols = DISPLAY_COLS, mid = (DISPLAY_ROWS >> 1) - 1, rows = [];
   for (var row = 0; row < DISPLAY_ROWS; row++) {
     var s = "";
     if (row === 0 || row === DISPLAY_ROWS - 1) { for (var c = 0; c < cols; c++) s += "#"; }
     else {
       s += "#";
       for (var c = 1; c < cols - 1; c++) {
-        if (row === 59) { var t = "  NES PDF TEST - click Run  "; s += t.charAt(Math.floor((c - 1) / 4) % t.length) || " "; }
-        else if (row === 60) { var t = "  (screen = field_0..119)  "; s += t.charAt(Math.floor((c - 1) / 4) % t.length) || " "; }
+        if (row === mid) { var t = "  NES PDF TEST - click Run  "; s += t.charAt(Math.floor((c - 1) / 4) % t.length) || " "; }
+        else if (row === mid + 1) { var t = "  (screen = field_0.." + (NUM_FIELDS - 1) + ")  "; s += t.charAt(Math.floor((c - 1) / 4) % t.length) || " "; }
         else s += (row % 5 === 0 || c % 10 === 0) ? "." : " ";
       }
       s += "#";
     }
-    try { var f = screenFields[row] || getField("field_" + row); if (f && "value" in f) f.value = s; } catch (e) {}
+    rows[row] = s;
   }
+  for (var b = 0; b < NUM_FIELDS; b++) writeBand(screenFields, rows, b, getField);
   debugLog("test drawn", 4);
 }
 drawTestPattern();
+"""
+
+# Hot-path profiler (--instrument), replaces PROFILER_PLACEHOLDER. Glue lines ending in //PROF feed it: nes.frame()
+# time, onFrame time and writeBand (field.value) time and count. Each emulated frame adds an emu sample (nes.frame()
+# minus onFrame); each drawn frame also adds conv (onFrame minus field writes), write and writes samples. The last
+# PROF_WINDOW samples of each are kept; profShow() puts avg/p95 in debug_5 and debug_6 every 60 emulated frames and
+# profileSummary() (app.nespdf_profileSummary) returns avg/p50/p95/max of all of them as text. Without --instrument
+# this block and the //PROF lines are left out of the PDF.
+PROFILER_SCRIPT = r"""
+var PROF_WINDOW = 120;
+var profNow = (typeof performance !== "undefined" && typeof performance.now === "function") ? function() { return performance.now(); } : function() { return Date.now(); };
+function profRing() { return { a: (typeof Float64Array !== "undefined") ? new Float64Array(PROF_WINDOW) : [], n: 0 }; }
+var prof = { emu: profRing(), conv: profRing(), write: profRing(), writes: profRing() };
+var profWriteMs = 0, profWrites = 0, profDrawMs = -1, profFrames = 0, profDrawn = 0;
+function profPush(r, v) { r.a[r.n % PROF_WINDOW] = v; r.n++; }
+function profEndFrame(frameMs) {
+  profFrames++;
+  profPush(prof.emu, frameMs - (profDrawMs >= 0 ? profDrawMs : 0));
+  if (profDrawMs >= 0) { profDrawn++; profPush(prof.conv, profDrawMs - profWriteMs); profPush(prof.write, profWriteMs); profPush(prof.writes, profWrites); }
+  profDrawMs = -1;
+}
+function profStats(r) {
+  var k = Math.min(r.n, PROF_WINDOW), s = [], sum = 0;
+  for (var i = 0; i < k; i++) { s[i] = r.a[i]; sum += r.a[i]; }
+  s.sort(function(a, b) { return a - b; });
+  if (!k) return { avg: 0, p50: 0, p95: 0, max: 0 };
+  return { avg: sum / k, p50: s[(k - 1) >> 1], p95: s[Math.min(k - 1, Math.floor(k * 0.95))], max: s[k - 1] };
+}
+function profFmt(v) { return String(Math.round(v * 10) / 10); }
+function profShow() {
+  var e = profStats(prof.emu), c = profStats(prof.conv), w = profStats(prof.write), n = profStats(prof.writes);
+  debugLog("emu " + profFmt(e.avg) + "/" + profFmt(e.p95) + " conv " + profFmt(c.avg) + "/" + profFmt(c.p95) + " ms", 5);
+  debugLog("write " + profFmt(w.avg) + "/" + profFmt(w.p95) + " ms x" + profFmt(n.avg) + "/" + profFmt(n.p95), 6);
+}
+function profileSummary() {
+  var lines = ["nespdf profile: " + profFrames + " frames emulated, " + profDrawn + " drawn; last " + PROF_WINDOW + " samples, avg/p50/p95/max"];
+  var names = ["emu", "conv", "write", "writes"], units = [" ms", " ms", " ms", " field writes"];
+  for (var i = 0; i < names.length; i++) {
+    var st = profStats(prof[names[i]]);
+    lines.push(names[i] + ": " + [st.avg, st.p50, st.p95, st.max].map(profFmt).join(" / ") + units[i]);
+  }
+  return lines.join("\n");
+}
+if (typeof globalThis !== "undefined") globalThis.profileSummary = profileSummary;
+if (typeof app !== "undefined") app.nespdf_profileSummary = profileSummary;
+"""
+
+# --- Renderers (framebuffer -> glyph rows); one of these replaces RENDERER_PLACEHOLDER ---
+# Original renderer: float luminance per pixel, if-chain per cell. Kept so frame cost can be compared (--renderer legacy).
+# It hard-codes 2x2 cells and GLYPH_RAMP, so it only supports the 128x120 profile.
+LEGACY_RENDERER = r"""
 function luminance(rgb24) {
   var r = (rgb24 >> 16) & 0xff, g = (rgb24 >> 8) & 0xff, b = rgb24 & 0xff;
   return (r * 0.299 + g * 0.587 + b * 0.114);
 }
-var rowCache = [];
-for (var r = 0; r < DISPLAY_ROWS; r++) rowCache[r] = "";
 function onFrame(fb) {
   var fields = (typeof app !== "undefined" && app.nespdf_screenFields) ? app.nespdf_screenFields : screenFields;
-  var db2 = (typeof app !== "undefined" && app.nespdf_debugField2) ? app.nespdf_debugField2 : debugField2;
+  var db2 = (typeof app !== "undefined" && app.nespdf_debugField2) ? app.nespdf_debugField2 : debugField2; //DEBUG
   var cache = (typeof app !== "undefined" && app.nespdf_rowCache) ? app.nespdf_rowCache : rowCache;
   var fc;
   if (typeof app !== "undefined") { app.nespdf_frameCount = (app.nespdf_frameCount || 0) + 1; fc = app.nespdf_frameCount; } else { frameCount++; fc = frameCount; }
-  if (fc % 5 === 0) { try { var d = (typeof app !== "undefined" && app.nespdf_debugLog) ? app.nespdf_debugLog : debugLog; if (db2 && "value" in db2) db2.value = "frames:" + fc; else d("frames:" + fc, 2); } catch (e) {} }
+  if (fc % 5 === 0) { try { var d = (typeof app !== "undefined" && app.nespdf_debugLog) ? app.nespdf_debugLog : debugLog; if (db2 && "value" in db2) db2.value = "frames:" + fc; else d("frames:" + fc, 2); } catch (e) {} } //DEBUG
+  var dirtyBand = -1;
   for (var row = 0; row < DISPLAY_ROWS; row++) {
     var s = "";
     for (var col = 0; col < DISPLAY_COLS; col++) {
@@ -90,112 +326,164 @@ function onFrame(fb) {
       else if (avg > 25) s += "b";
       else s += "#";
     }
+    if (s !== cache[row]) { cache[row] = s; dirtyBand = (row / ROW_BAND) | 0; }
+    if (dirtyBand >= 0 && (row % ROW_BAND === ROW_BAND - 1 || row === DISPLAY_ROWS - 1)) { writeBand(fields, cache, dirtyBand, typeof app !== "undefined" && app.nespdf_getField); dirtyBand = -1; }
+  }
+}
+"""
+
+# Table renderer: luminance is looked up per pixel in a build-time table of the jsnes palette (perfect hash on the
+# RGB value, checked against the stored key), summed per BLOCK x BLOCK cell as integers, and the sum is bucketed into
+# a glyph table built from the profile's ramp.
+# Luminance is scaled by 1000 (299r + 587g + 114b) so the ramp thresholds stay exact. Per-frame app lookups are hoisted.
+# Rows are only converted when their source pixels differ from the previous frame (prevFb); the per-frame counts of
+# converted and written rows are kept in rowsConverted/rowsWritten (app.nespdf_rowsConverted/_rowsWritten) and debug_2,
+# along with fieldWrites, the number of field.value assignments (fewer than rowsWritten when --band > 1).
+# Changed rows mark their screen field dirty (bandDirty); the fields are written after the conversion pass, at most
+# FIELD_BUDGET of them. The scan starts after the last field written by the previous frame, so a scroll-heavy frame
+# spreads its writes over the next ones and the fields left over are written first. fieldsPending (debug_2 "left:")
+# counts the dirty fields carried over.
+LUT_RENDERER = r"""
+var BLOCK_SHIFT = BLOCK_SHIFT_VALUE;
+var LUM_MOD = LUM_MOD_VALUE;
+var LUM_STEP = LUM_STEP_VALUE;
+var GLYPH_BUCKETS = GLYPH_BUCKETS_VALUE;
+var PALETTE_RGB = PALETTE_RGB_VALUE;
+var PALETTE_LUM = PALETTE_LUM_VALUE;
+function makeIntArray(n, v) { var a = (typeof Int32Array !== "undefined") ? new Int32Array(n) : []; for (var i = 0; i < n; i++) a[i] = v; return a; }
+var lumKey = makeIntArray(LUM_MOD, -1), lumVal = makeIntArray(LUM_MOD, 0), lumAcc = makeIntArray(DISPLAY_COLS, 0);
+for (var i = 0; i < PALETTE_RGB.length; i++) { lumKey[PALETTE_RGB[i] % LUM_MOD] = PALETTE_RGB[i]; lumVal[PALETTE_RGB[i] % LUM_MOD] = PALETTE_LUM[i]; }
+var prevFb = makeIntArray(256 * 240, -1);
+var FIELD_BUDGET = FIELD_BUDGET_VALUE;
+var bandDirty = makeIntArray(NUM_FIELDS, 0), bandCursor = 0;
+var rowsConverted = 0, rowsWritten = 0, fieldWrites = 0, fieldsPending = 0;
+function onFrame(fb) {
+  var hasApp = typeof app !== "undefined";
+  var fields = (hasApp && app.nespdf_screenFields) || screenFields;
+  var db2 = (hasApp && app.nespdf_debugField2) || debugField2; //DEBUG
+  var cache = (hasApp && app.nespdf_rowCache) || rowCache;
+  var getF = hasApp && app.nespdf_getField;
+  var fc;
+  if (hasApp) { fc = app.nespdf_frameCount = (app.nespdf_frameCount || 0) + 1; } else { fc = ++frameCount; }
+  var keys = lumKey, vals = lumVal, mod = LUM_MOD, step = LUM_STEP, glyphs = GLYPH_BUCKETS, acc = lumAcc, cols = DISPLAY_COLS, prev = prevFb;
+  var converted = 0, written = 0, writes = 0, pending = 0, dirty = bandDirty;
+  for (var row = 0; row < DISPLAY_ROWS; row++) {
+    var c, x, p, h, lp = -1, l = 0, o = (row << BLOCK_SHIFT) * 256, e = o + (256 << BLOCK_SHIFT);
+    // Dirty-row check on the raw pixels: rows whose source scanlines match the previous frame are skipped
+    for (x = o; x < e && fb[x] === prev[x]; x++) {}
+    if (x === e) continue;
+    for (; x < e; x++) prev[x] = fb[x];
+    converted++;
+    for (c = 0; c < cols; c++) acc[c] = 0;
+    // The row's source scanlines are contiguous in fb, cell = (x & 255) >> BLOCK_SHIFT. Runs of one color skip the lookup.
+    for (x = o; x < e; x++) {
+      p = fb[x];
+      if (p !== lp) { lp = p; h = p % mod; l = (keys[h] === p) ? vals[h] : ((p >> 16) & 0xff) * 299 + ((p >> 8) & 0xff) * 587 + (p & 0xff) * 114; }
+      acc[(x & 255) >> BLOCK_SHIFT] += l;
+    }
+    var s = "";
+    for (c = 0; c < cols; c++) s += glyphs[((acc[c] - 1) / step) | 0];
     if (s === cache[row]) continue;
     cache[row] = s;
-    try { var f = fields[row] || (typeof app !== "undefined" && app.nespdf_getField && app.nespdf_getField("field_" + row)); if (f && "value" in f) f.value = s; } catch (e) {}
+    written++;
+    dirty[(row / ROW_BAND) | 0] = 1;
   }
-}
-var nes = new jsnes.NES({ onFrame: onFrame, onAudioSample: function() {} });
-debugLog("jsnes ok");
-function base64Decode(b) {
-  var k = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/", r = "", i, n1, n2, n3, n4, outLen;
-  for (i = 0; i < b.length; i += 4) {
-    n1 = k.indexOf(b[i]); n2 = k.indexOf(b[i+1]); n3 = b[i+2]==="=" ? -1 : k.indexOf(b[i+2]); n4 = b[i+3]==="=" ? -1 : k.indexOf(b[i+3]);
-    if (n1 < 0 || n2 < 0) break;
-    r += String.fromCharCode((n1<<2)|(n2>>4));
-    if (n3 >= 0) r += String.fromCharCode(((n2&15)<<4)|(n3>>2));
-    if (n4 >= 0) r += String.fromCharCode(((n3&3)<<6)|n4);
+  var budget = FIELD_BUDGET || NUM_FIELDS;
+  for (var k = 0, b = bandCursor; k < NUM_FIELDS; k++, b = (b + 1 === NUM_FIELDS) ? 0 : b + 1) {
+    if (!dirty[b]) continue;
+    if (writes === budget) { pending++; continue; }
+    writeBand(fields, cache, b, getF);
+    writes++;
+    dirty[b] = 0;
+    if (FIELD_BUDGET) bandCursor = (b + 1 === NUM_FIELDS) ? 0 : b + 1;
   }
-  return r;
-}
-function toBinaryString(x) {
-  if (typeof x === "string") return x;
-  if (x && typeof x.length === "number") { var s = ""; for (var i = 0; i < x.length; i++) s += String.fromCharCode((x[i] != null ? x[i] : 0) & 255); return s; }
-  return "";
-}
-function ensureBinaryString(s) {
-  if (typeof s !== "string" || s.length === 0) return "";
-  var out = "";
-  for (var i = 0; i < s.length; i++) out += String.fromCharCode(s.charCodeAt(i) & 0xff);
-  return out;
+  rowsConverted = converted; rowsWritten = written; fieldWrites = writes; fieldsPending = pending;
+  if (hasApp) { app.nespdf_rowsConverted = converted; app.nespdf_rowsWritten = written; app.nespdf_fieldWrites = writes; app.nespdf_fieldsPending = pending; }
+  if (fc % 5 === 0) { //DEBUG
+    var msg = "frames:" + fc + " conv:" + converted + " wr:" + written + (ROW_BAND > 1 ? " set:" + writes : "") + (FIELD_BUDGET ? " left:" + pending : ""); //DEBUG
+    try { if (db2 && "value" in db2) db2.value = msg; else ((hasApp && app.nespdf_debugLog) || debugLog)(msg, 2); } catch (e) {} //DEBUG
+  } //DEBUG
 }
-var romStr = "";
-try {
-  romStr = base64Decode(romBase64);
-  if (!romStr && typeof atob === "function") romStr = atob(romBase64);
-  if (!romStr && typeof util !== "undefined" && util.decodeBase64) romStr = toBinaryString(util.decodeBase64(romBase64));
-} catch (e) {}
-romStr = ensureBinaryString(romStr);
-var nesHeader = String.fromCharCode(0x4e, 0x45, 0x53, 0x1a);
-var romOk = (romStr.length >= 16 && romStr.indexOf(nesHeader) === 0);
-if (!romOk) debugLog("rom bad len=" + romStr.length + " h=" + (romStr.length>=4 ? [romStr.charCodeAt(0),romStr.charCodeAt(1),romStr.charCodeAt(2),romStr.charCodeAt(3)].join(",") : "?"), 4);
-var running = false;
-var frameCount = 0;
-var keysDown = [];
-for (var i = 0; i < 8; i++) keysDown[i] = false;
-function toggleKey(btn) {
-  var k = (typeof app !== "undefined" && app.nespdf_keysDown) ? app.nespdf_keysDown : keysDown;
-  if (k[btn]) { keyUp(btn); k[btn] = false; }
-  else { keyDown(btn); k[btn] = true; }
-}
-function runOneFrame() {
-  var n = (typeof app !== "undefined" && app.nespdf_nes) ? app.nespdf_nes : nes;
-  if (n && typeof n.frame === "function") { try { n.frame(); } catch(e) {} }
+"""
+RENDERERS = ("lut", "legacy")
+
+# ROM decoders (--rom-encoding); each defines decodeRom(text) -> binary string for nes.loadROM.
+# base64: native atob / util.decodeBase64 when the viewer has them, else a charCode -> sextet table into a byte array.
+# hex: twice the size of the raw ROM before compression, but decodes with a nibble table in one pass.
+ROM_DECODERS = {
+    "base64": r"""
+function decodeRom(s) {
+  try { if (typeof atob === "function") { var a = atob(s); if (a) return a; } } catch (e) {}
+  try { if (typeof util !== "undefined" && util.decodeBase64) { var u = toBinaryString(util.decodeBase64(s)); if (u) return u; } } catch (e) {}
+  var k = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/", t = [], i, j, v;
+  for (i = 0; i < 128; i++) t[i] = 0;
+  for (i = 0; i < 64; i++) t[k.charCodeAt(i)] = i;
+  var n = s.length, pad = (s.charAt(n - 1) === "=") + (s.charAt(n - 2) === "=");
+  var len = (n >> 2) * 3 - pad, out = (typeof Uint8Array !== "undefined") ? new Uint8Array(len) : [];
+  for (i = 0, j = 0; i < n; i += 4) {
+    v = (t[s.charCodeAt(i)] << 18) | (t[s.charCodeAt(i + 1)] << 12) | (t[s.charCodeAt(i + 2)] << 6) | t[s.charCodeAt(i + 3)];
+    out[j++] = (v >> 16) & 255;
+    if (j < len) out[j++] = (v >> 8) & 255;
+    if (j < len) out[j++] = v & 255;
+  }
+  return bytesToString(out);
 }
-function tick() {
-  if (typeof app !== "undefined" && app.nespdf_running === false) return;
-  if (!running && (typeof app === "undefined" || app.nespdf_running !== true)) return;
-  runOneFrame();
-  if (typeof app !== "undefined" && app.nespdf_useInterval) return;
-  if (typeof app !== "undefined" && app.setTimeout) app.setTimeout("app.nespdf_tick()", 33);
-  else if (typeof setTimeout !== "undefined") setTimeout(tick, 33);
+""",
+    "hex": r"""
+function decodeRom(s) {
+  var t = [], i, j;
+  for (i = 0; i < 128; i++) t[i] = 0;
+  for (i = 0; i < 16; i++) t["0123456789abcdef".charCodeAt(i)] = i;
+  var len = s.length >> 1, out = (typeof Uint8Array !== "undefined") ? new Uint8Array(len) : [];
+  for (i = 0, j = 0; j < len; i += 2, j++) out[j] = (t[s.charCodeAt(i)] << 4) | t[s.charCodeAt(i + 1)];
+  return bytesToString(out);
 }
-function startEmulator() {
-  debugLog("run clicked", 1);
-  if (running) return;
-  running = true;
-  if (typeof app !== "undefined") app.nespdf_running = true;
-  if (!romOk) { debugLog("rom invalid", 1); running = false; if (typeof app !== "undefined") app.nespdf_running = false; return; }
-  try { nes.loadROM(romStr); debugLog("rom ok", 1); } catch(e) { debugLog("rom err:" + e, 1); running = false; if (typeof app !== "undefined") app.nespdf_running = false; return; }
-  if (typeof app !== "undefined") { app.nespdf_tick = tick; app.nespdf_nes = nes; app.nespdf_runOneFrame = runOneFrame; app.nespdf_useInterval = false; }
-  for (var i = 0; i < 5; i++) runOneFrame();
-  if (typeof app !== "undefined" && app.setInterval) { app.setInterval("app.nespdf_tick()", 33); app.nespdf_useInterval = true; debugLog("interval on", 1); }
-  else if (typeof app !== "undefined" && app.setTimeout) { app.setTimeout("app.nespdf_tick()", 33); debugLog("timeout on", 1); }
-  else if (typeof setInterval !== "undefined") { setInterval(tick, 33); if (typeof app !== "undefined") app.nespdf_useInterval = true; debugLog("interval on", 1); }
-  else if (typeof setTimeout !== "undefined") { setTimeout(tick, 33); debugLog("timeout on", 1); }
-  else { running = false; if (typeof app !== "undefined") app.nespdf_running = false; debugLog("no timer", 1); return; }
+""",
 }
-if (typeof setTimeout !== "undefined") setTimeout(startEmulator, 350); else if (typeof app !== "undefined" && app.setTimeout) app.setTimeout("startEmulator()", 350); else startEmulator();
-function keyDown(btn) { var n = (typeof app !== "undefined" && app.nespdf_nes) ? app.nespdf_nes : nes; try { if (n) n.buttonDown(1, btn); } catch(e) {} }
-function keyUp(btn) { var n = (typeof app !== "undefined" && app.nespdf_nes) ? app.nespdf_nes : nes; try { if (n) n.buttonUp(1, btn); } catch(e) {} }
-if (typeof globalThis !== "undefined") { globalThis.startEmulator = startEmulator; globalThis.keyDown = keyDown; globalThis.keyUp = keyUp; globalThis.toggleKey = toggleKey; globalThis.debugLog = debugLog; globalThis.tick = tick; globalThis.nes = nes; if (typeof jsnes !== "undefined") globalThis.jsnes = jsnes; }
-if (typeof app !== "undefined") { app.nespdf_tick = tick; app.startEmulator = startEmulator; app.nespdf_keyDown = keyDown; app.nespdf_keyUp = keyUp; app.nespdf_toggleKey = toggleKey; app.nespdf_keysDown = keysDown; app.nespdf_screenFields = screenFields; app.nespdf_debugField2 = debugField2; app.nespdf_rowCache = rowCache; app.nespdf_getField = getField; app.nespdf_debugLog = debugLog; }
-"""
+
+# --- jsnes patches ---
+# (name, regex on jsnes.min.js, replacement, required match count), applied in order. The build fails when a patch
+# does not match exactly that many times, so a jsnes update cannot silently drop one. --disable-patch NAME turns a
+# patch off to measure its size / frame-time effect; check_nes_pattern.py reports the match counts.
+JSNES_PATCHES = [
+    # PDF viewers can mishandle the literal \x1a in embedded JS; use runtime header so validation matches our romStr
+    ("nes-header", re.escape('.indexOf("NES\x1a")'), ".indexOf(String.fromCharCode(78,69,83,26))", 1),
+    # PAPU.clockFrameCounter: drop per-cycle sample accumulation and the sample() mixer/onAudioSample call. Frame IRQ,
+    # length counters and DMC DMA are untouched, so $4015 reads and CPU timing stay the same.
+    ("audio-sample",
+     re.escape(",this.accSample(t),this.sampleTimer+=t<<10,this.sampleTimer>=this.sampleTimerMax&&(this.sample(),this.sampleTimer-=this.sampleTimerMax)}"),
+     "}", 1),
+    # PAPU.clockFrameCounter: drop triangle/square/noise waveform stepping, which only feeds the audio output
+    ("audio-waveforms", r"if\(e\.progTimerMax>0\)for\(e\.progTimerCount-=t;.*?n\.accValue\+=n\.sampleValue,n\.accCount\+\+;", "", 1),
+]
 
 # jsnes Controller: A=0, B=1, SELECT=2, START=3, UP=4, DOWN=5, LEFT=6, RIGHT=7
 # Toggle: click = press (keyDown), click again = release (keyUp) so holding one button = continuous move
+# (field name, label, Controller button or None for Run). Every button's action is the inline BUTTON_ACTION calling
+# the glue's shared pressButton(index).
 BUTTONS = [
-    ("btn_Run", "Run", "var D=globalThis.debugLog||function(){}; D('Run',3); var fn=(globalThis.startEmulator||(typeof startEmulator==='function'?startEmulator:null)); if(fn) fn();"),
-    ("btn_Up", "U", "var D=globalThis.debugLog||function(){}; D('U',3); var J=globalThis.jsnes||jsnes,C=J.Controller,T=(typeof app!=='undefined'&&app.nespdf_toggleKey)||globalThis.toggleKey; if(T) T(C.BUTTON_UP);"),
-    ("btn_Down", "D", "var D=globalThis.debugLog||function(){}; D('D',3); var J=globalThis.jsnes||jsnes,C=J.Controller,T=(typeof app!=='undefined'&&app.nespdf_toggleKey)||globalThis.toggleKey; if(T) T(C.BUTTON_DOWN);"),
-    ("btn_Left", "L", "var D=globalThis.debugLog||function(){}; D('L',3); var J=globalThis.jsnes||jsnes,C=J.Controller,T=(typeof app!=='undefined'&&app.nespdf_toggleKey)||globalThis.toggleKey; if(T) T(C.BUTTON_LEFT);"),
-    ("btn_Right", "R", "var D=globalThis.debugLog||function(){}; D('R',3); var J=globalThis.jsnes||jsnes,C=J.Controller,T=(typeof app!=='undefined'&&app.nespdf_toggleKey)||globalThis.toggleKey; if(T) T(C.BUTTON_RIGHT);"),
-    ("btn_Select", "Se", "var D=globalThis.debugLog||function(){}; D('Se',3); var J=globalThis.jsnes||jsnes,C=J.Controller,T=(typeof app!=='undefined'&&app.nespdf_toggleKey)||globalThis.toggleKey; if(T) T(C.BUTTON_SELECT);"),
-    ("btn_Start", "St", "var D=globalThis.debugLog||function(){}; D('St',3); var J=globalThis.jsnes||jsnes,C=J.Controller,T=(typeof app!=='undefined'&&app.nespdf_toggleKey)||globalThis.toggleKey; if(T) T(C.BUTTON_START);"),
-    ("btn_B", "B", "var D=globalThis.debugLog||function(){}; D('B',3); var J=globalThis.jsnes||jsnes,C=J.Controller,T=(typeof app!=='undefined'&&app.nespdf_toggleKey)||globalThis.toggleKey; if(T) T(C.BUTTON_B);"),
-    ("btn_A", "A", "var D=globalThis.debugLog||function(){}; D('A',3); var J=globalThis.jsnes||jsnes,C=J.Controller,T=(typeof app!=='undefined'&&app.nespdf_toggleKey)||globalThis.toggleKey; if(T) T(C.BUTTON_A);"),
+    ("btn_Run", "Run", None),
+    ("btn_Up", "U", 4),
+    ("btn_Down", "D", 5),
+    ("btn_Left", "L", 6),
+    ("btn_Right", "R", 7),
+    ("btn_Select", "Se", 2),
+    ("btn_Start", "St", 3),
+    ("btn_B", "B", 1),
+    ("btn_A", "A", 0),
 ]
+BUTTON_ACTION = "var P=(typeof app!=='undefined'&&app.nespdf_press)||globalThis.pressButton; if(P) P(INDEX);"
 NUM_BUTTONS = len(BUTTONS)
 
 # Page size (points)
 PAGE_W, PAGE_H = 612, 792
-# Screen: NES 256x240 with 8:7 pixel aspect -> display ratio 2048:1680 = 1.219. Full 128x120 chars visible.
+# Screen: NES 256x240 with 8:7 pixel aspect -> display ratio 2048:1680 = 1.219.
 # Target: width 512pt, height 512/1.22 = 420pt so ratio correct and fits page (margins 50 left, 50 right, 30 top).
+# 128x120 profile: CHAR_WIDTH = 512/128 = 4, ROW_HEIGHT = 420/120 = 3.5, 8pt Courier; other profiles scale from there.
 SCREEN_X = 50
-SCREEN_TOP = 762  # top of row 0; bottom of row 119 at 762 - 120*ROW_HEIGHT
-# 128*CHAR_WIDTH = 512, 120*ROW_HEIGHT = 420 => CHAR_WIDTH=4, ROW_HEIGHT=3.5; ratio 512/420 = 1.22
-CHAR_WIDTH = 4.0
-ROW_HEIGHT = 3.5
+SCREEN_TOP = 762  # top of row 0; bottom of the last row at 762 - SCREEN_H
+SCREEN_W = 512
+SCREEN_H = 420
 BTN_SIZE = 28
 # NES-style layout: below screen, moved up (y +160). (x,y) = bottom-left of button.
 # Run center; D-pad U/D/L/R; Select, Start; B, A
@@ -205,6 +493,11 @@ BTN_POSITIONS = [
     (165, 242), (215, 242),   # 5-6 Select Start
     (280, 242), (328, 242),   # 7-8 B A
 ]
+# Cartridge ROM picker (several --rom): one button per ROM, ROM_PICKER_COLS per row from (x, y) downwards
+ROM_PICKER_X, ROM_PICKER_Y = 50, 190  # bottom-left of the first button
+ROM_PICKER_W, ROM_PICKER_H, ROM_PICKER_GAP = 80, 20, 6
+ROM_PICKER_COLS = 6
+MAX_ROMS = 36  # six rows, the last at y = 60
 
 
 def pdf_escape(s):
@@ -217,18 +510,21 @@ def stream_escape(s):
     return s.replace("\rendstream", "\r").replace("\nendstream", "\n")
 
 
-def make_text_field(obj_id, name, x, y, w, h, default_val="", with_border_style=False, use_monospace=False):
+def make_text_field(obj_id, page_id, name, x, y, w, h, default_val="", with_border_style=False, use_monospace=False,
+                    lines=1, leading=None, font_size=8, max_len=256):
     v = pdf_escape(default_val) if default_val else ""
     bs = "/BS << /W 0 >> " if with_border_style else ""
-    da = " /DA (/Cour 8 Tf 0 g)" if use_monospace else ""
+    tl = f" {leading:g} TL" if leading is not None else ""
+    da = f" /DA (/Cour {font_size:g} Tf{tl} 0 g)" if use_monospace else ""
+    ff = 2 | 4096 if lines > 1 else 2  # bit 13 = Multiline
     return f"""{obj_id} 0 obj
 <<
 {bs}/F 4
 /FT /Tx
-/Ff 2
-/MaxLen 256
+/Ff {ff}
+/MaxLen {max_len}
 /MK <<>>
-/P {PAGE_ID} 0 R
+/P {page_id} 0 R
 /Q 0
 /Rect [ {x:.1f} {y:.1f} {x + w:.1f} {y + h:.1f} ]
 /Subtype /Widget
@@ -240,18 +536,20 @@ endobj
 """
 
 
-def make_button(obj_id, name, label, script_ref, x, y, w, h, add_aa_u=False):
+def make_button(obj_id, page_id, name, label, script, x, y, w, h, add_aa_u=False):
+    """Push button running script: a script stream's object number, or a short script (str) inline in the action."""
+    js = f"{script} 0 R" if isinstance(script, int) else f"({pdf_escape(script)})"
     aa_u = ""
     if add_aa_u:
-        aa_u = f"/AA << /U << /JS {script_ref} 0 R /S /JavaScript >> >> "
+        aa_u = f"/AA << /U << /JS {js} /S /JavaScript >> >> "
     return f"""{obj_id} 0 obj
 <<
-/A << /JS {script_ref} 0 R /S /JavaScript >>
+/A << /JS {js} /S /JavaScript >>
 {aa_u}/F 4
 /FT /Btn
 /Ff 65536
 /MK << /BG [ 0.9 0.9 0.9 ] /CA ({pdf_escape(label)}) >>
-/P {PAGE_ID} 0 R
+/P {page_id} 0 R
 /Rect [ {x:.1f} {y:.1f} {x + w:.1f} {y + h:.1f} ]
 /Subtype /Widget
 /T ({pdf_escape(name)})
@@ -261,7 +559,11 @@ endobj
 """
 
 
-def make_script_stream(obj_id, content):
+def make_script_stream(obj_id, content, compress=False):
+    """Stream object as bytes; compress applies /FlateDecode (zlib level 9)."""
+    if compress:
+        data = zlib.compress(content.encode("utf-8"), 9)
+        return f"{obj_id} 0 obj\n<< /Filter /FlateDecode /Length {len(data)} >>\nstream\n".encode() + data + b"\nendstream\nendobj\n"
     escaped = stream_escape(content)
     return f"""{obj_id} 0 obj
 << /Length {len(escaped)} >>
@@ -269,120 +571,660 @@ stream
 {escaped}
 endstream
 endobj
-"""
+""".encode("utf-8")
 
 
-def main():
-    base = os.path.dirname(os.path.abspath(__file__))
-    jsnes_path = os.path.join(base, "jsnes.min.js")
-    rom_path = os.path.join(base, "mario.nes")
+def make_object_stream(obj_id, objects):
+    """PDF 1.5 object stream (/Type /ObjStm, Flate) holding serialized non-stream objects ("N 0 obj ... endobj").
+    Returns the stream object as bytes and {member number: index in stream} for the xref stream."""
+    pairs, bodies, offset = [], [], 0
+    for text in objects:
+        m = re.match(r"(\d+) 0 obj\n(.*)endobj\n$", text, re.S)
+        body = m.group(2).encode("utf-8")
+        pairs.append(f"{m.group(1)} {offset}")
+        bodies.append(body)
+        offset += len(body)
+    first = (" ".join(pairs) + "\n").encode()
+    data = zlib.compress(first + b"".join(bodies), 9)
+    members = {int(pair.split()[0]): i for i, pair in enumerate(pairs)}
+    head = f"{obj_id} 0 obj\n<< /Type /ObjStm /N {len(pairs)} /First {len(first)} /Filter /FlateDecode /Length {len(data)} >>\nstream\n"
+    return head.encode() + data + b"\nendstream\nendobj\n", members
 
-    if not os.path.isfile(jsnes_path):
-        print("Error: jsnes.min.js not found", file=sys.stderr)
-        sys.exit(1)
-    if not os.path.isfile(rom_path):
-        print("Error: mario.nes not found", file=sys.stderr)
+
+def make_xref_stream(obj_id, offset, offsets, packed, root_id):
+    """Cross-reference stream (PDF 1.5) written at byte offset `offset`. offsets: {num: byte offset} for top-level
+    objects; packed: {num: (object stream number, index)} for objects inside object streams."""
+    size = obj_id + 1
+    rows = [bytes([0]) + (0).to_bytes(4, "big") + (65535).to_bytes(2, "big")]
+    for i in range(1, size):
+        if i == obj_id:
+            rows.append(bytes([1]) + offset.to_bytes(4, "big") + (0).to_bytes(2, "big"))
+        elif i in offsets:
+            rows.append(bytes([1]) + offsets[i].to_bytes(4, "big") + (0).to_bytes(2, "big"))
+        elif i in packed:
+            rows.append(bytes([2]) + packed[i][0].to_bytes(4, "big") + packed[i][1].to_bytes(2, "big"))
+        else:
+            rows.append(bytes([0]) + (0).to_bytes(4, "big") + (0).to_bytes(2, "big"))
+    data = zlib.compress(b"".join(rows), 9)
+    head = (f"{obj_id} 0 obj\n<< /Type /XRef /Size {size} /W [ 1 4 2 ] /Root {root_id} 0 R "
+            f"/Filter /FlateDecode /Length {len(data)} >>\nstream\n")
+    return head.encode() + data + b"\nendstream\nendobj\n"
+
+
+class PdfWriter:
+    """Writes PDF objects straight to a binary file and records each object's byte offset as it goes, so the xref
+    comes from known positions rather than from scanning the output (stream data may contain "N 0 obj")."""
+
+    def __init__(self, f, binary=True):
+        self.f = f
+        self.pos = 0
+        self.offsets = {}  # object number -> byte offset
+        self.packed = {}  # object number -> (object stream number, index)
+        # Binary comment line after the header when streams are compressed, so transfer tools treat the file as binary
+        self._write(b"%PDF-1.6\n%\xe2\xe3\xcf\xd3\n" if binary else b"%PDF-1.6\n\n")
+
+    def _write(self, data):
+        self.f.write(data)
+        self.pos += len(data)
+
+    def write_object(self, obj):
+        """Write one serialized object ("N 0 obj ... endobj", str or bytes); the number is read from its prefix."""
+        if isinstance(obj, str):
+            obj = obj.encode("utf-8")
+        self.offsets[int(obj[: obj.index(b" ")])] = self.pos
+        self._write(obj)
+
+    def write_object_stream(self, obj_id, objects):
+        data, members = make_object_stream(obj_id, objects)
+        self.packed.update((num, (obj_id, index)) for num, index in members.items())
+        self.write_object(data)
+
+    def finish(self, root_id, xref_stream_id=None):
+        """Write the cross-reference section (table, or stream when xref_stream_id is given) and the trailer."""
+        startxref = self.pos
+        if xref_stream_id is not None:
+            self.write_object(make_xref_stream(xref_stream_id, startxref, self.offsets, self.packed, root_id))
+            self._write(b"startxref\n%d\n%%%%EOF\n" % startxref)
+            return
+        size = max(self.offsets) + 1
+        xref_lines = ["xref", "0 %d" % size, "0000000000 65535 f "]
+        for i in range(1, size):
+            if i in self.offsets:
+                xref_lines.append("%010d 00000 n " % self.offsets[i])
+            else:
+                xref_lines.append("0000000000 00000 f ")
+        self._write(("\n".join(xref_lines) + "\n").encode())
+        self._write(b"trailer\n<<\n/Root %d 0 R\n/Size %d\n>>\nstartxref\n%d\n%%%%EOF\n" % (root_id, size, startxref))
+
+
+class LinearizedPdfWriter(PdfWriter):
+    """PdfWriter for a linearized ("fast web view", PDF Annex F) one-page file. Objects are buffered and laid out on
+    finish(): linearization dictionary, first-page xref, catalog, primary hint stream, then the page followed by every
+    other object numbered from ids["linearization"] up (fields, fonts), then the objects numbered below
+    it (page tree, jsnes/ROM script) and the main xref. Every number written before the layout is known is fixed-width,
+    so offsets are computed before anything after the header is written."""
+
+    def __init__(self, f, ids, binary=True):
+        super().__init__(f, binary)
+        self.ids = ids
+        self.objects = {}  # object number -> serialized bytes, in write order
+
+    def write_object(self, obj):
+        if isinstance(obj, str):
+            obj = obj.encode("utf-8")
+        self.objects[int(obj[: obj.index(b" ")])] = obj
+
+    def finish(self, root_id, xref_stream_id=None):
+        lin_id, hint_id, page_id = self.ids["linearization"], self.ids["hint_stream"], self.ids["page"]
+        # Part 4 catalog, part 5 primary hint stream, part 6 first page (page object first); the rest after /E
+        first = [root_id, hint_id, page_id] + [n for n in self.objects if n > lin_id and n not in (root_id, page_id)]
+        rest = [n for n in self.objects if n < lin_id]
+        size = lin_id + 1 + len(first)
+
+        def lin_dict(length, hint_offset, hint_length, end_first, main_entry):
+            return (f"{lin_id} 0 obj\n<< /Linearized 1 /L {length:010d} /H [ {hint_offset:010d} {hint_length:010d} ] "
+                    f"/O {page_id} /E {end_first:010d} /N 1 /T {main_entry:010d} >>\nendobj\n").encode()
+
+        def xref(first_num, offsets, trailer):
+            entries = ["%010d 00000 n " % o if o is not None else "0000000000 65535 f " for o in offsets]
+            return ("\n".join(["xref", f"{first_num} {len(offsets)}"] + entries) + "\ntrailer\n" + trailer).encode()
+
+        def hint_stream(page_offset, page_length):
+            # Page offset hint table header (F.4.1): one page with no content stream and no shared objects, so every
+            # per-page bit width is 0 and the per-page entries take no space. Then the shared object hint table
+            # header (F.4.2) with no entries.
+            page_table = b"".join(v.to_bytes(bits // 8, "big") for v, bits in (
+                (len(first) - 2, 32), (page_offset, 32), (0, 16), (page_length, 32), (0, 16), (0, 32), (0, 16),
+                (0, 32), (0, 16), (0, 16), (0, 16), (0, 16), (1, 16)))
+            shared_table = bytes(24)
+            data = page_table + shared_table
+            head = f"{hint_id} 0 obj\n<< /S {len(page_table)} /Length {len(data)} >>\nstream\n".encode()
+            return head + data + b"\nendstream\nendobj\n"
+
+        first_xref_len = len(xref(lin_id, [0] * (size - lin_id), f"<< /Size {size} /Prev {0:010d} /Root {root_id} 0 R >>\nstartxref\n0\n%%EOF\n"))
+        hint_len = len(hint_stream(0, 0))
+        pos = self.pos + len(lin_dict(0, 0, 0, 0, 0)) + first_xref_len
+        offsets = {lin_id: self.pos}
+        for n in first:
+            offsets[n] = pos
+            pos += hint_len if n == hint_id else len(self.objects[n])
+        end_first = pos
+        for n in rest:
+            offsets[n] = pos
+            pos += len(self.objects[n])
+        main_xref_pos = pos
+        main_entry = main_xref_pos + len(f"xref\n0 {lin_id}")  # the newline before the entry for object 0
+        first_xref_pos = self.pos + len(lin_dict(0, 0, 0, 0, 0))
+        main_xref = xref(0, [None] + [offsets[n] for n in range(1, lin_id)], f"<< /Size {lin_id} >>\nstartxref\n{first_xref_pos}\n%%EOF\n")
+        length = main_xref_pos + len(main_xref)
+
+        self._write(lin_dict(length, offsets[hint_id], hint_len, end_first, main_entry))
+        self._write(xref(lin_id, [offsets[n] for n in range(lin_id, size)],
+                         f"<< /Size {size} /Prev {main_xref_pos:010d} /Root {root_id} 0 R >>\nstartxref\n0\n%%EOF\n"))
+        for n in first:
+            # Hint table offsets are given as if the hint stream were not there
+            self._write(hint_stream(offsets[page_id] - hint_len, end_first - offsets[page_id]) if n == hint_id else self.objects[n])
+        for n in rest:
+            self._write(self.objects[n])
+        self._write(main_xref)
+
+
+class BuildCache:
+    """Content-addressed store for build artifacts under root (root None = no caching, everything is rebuilt).
+
+    An entry's key is the sha256 of its kind, this script's source and every input it is built from, so a changed
+    ROM, jsnes, option or builder just misses. Entries are files root/<key[:2]>/<key>; a hit bumps the file's mtime
+    and trim() deletes the least recently used entries until the cache fits in max_bytes."""
+
+    def __init__(self, root, max_bytes=CACHE_MAX_MB << 20):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        if root is not None:
+            with open(os.path.abspath(__file__), "rb") as f:
+                self.salt = hashlib.sha256(f.read()).digest()
+
+    def _path(self, kind, parts):
+        h = hashlib.sha256(self.salt)
+        for part in (kind,) + tuple(parts):
+            if isinstance(part, str):
+                part = part.encode("utf-8")
+            h.update(b"%d:" % len(part))
+            h.update(part)
+        key = h.hexdigest()
+        return os.path.join(self.root, key[:2], key)
+
+    def _lookup(self, path):
+        if os.path.isfile(path):
+            os.utime(path)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def _store(self, path, src=None, data=None):
+        """Copy file src (or write data) into the entry via a temporary file, so a concurrent batch worker never
+        reads a partial entry."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        if src is not None:
+            shutil.copyfile(src, tmp)
+        else:
+            with open(tmp, "wb") as f:
+                f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, kind, parts, make):
+        """Cached bytes for (kind, parts); on a miss make() -> bytes builds them."""
+        if self.root is None:
+            return make()
+        path = self._path(kind, parts)
+        if self._lookup(path):
+            with open(path, "rb") as f:
+                return f.read()
+        data = make()
+        self._store(path, data=data)
+        return data
+
+    def get_text(self, kind, parts, make):
+        """get() for artifacts that are str."""
+        return self.get(kind, parts, lambda: make().encode("utf-8")).decode("utf-8")
+
+    def get_json(self, kind, parts, make):
+        """get() for JSON-serializable artifacts (tuples come back as lists)."""
+        return json.loads(self.get(kind, parts, lambda: json.dumps(make()).encode("utf-8")))
+
+    def get_file(self, kind, parts, out_path, make):
+        """Copy the cached file for (kind, parts) to out_path; on a miss make(out_path) writes it and it is stored."""
+        if self.root is None:
+            make(out_path)
+            return
+        path = self._path(kind, parts)
+        if self._lookup(path):
+            shutil.copyfile(path, out_path)
+            return
+        make(out_path)
+        self._store(path, src=out_path)
+
+    def trim(self):
+        """Delete least recently used entries until the cache is at most max_bytes. Returns the bytes removed."""
+        if self.root is None or not os.path.isdir(self.root):
+            return 0
+        entries = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(dirpath, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += size
+        return removed
+
+
+def apply_jsnes_patches(jsnes_content, disabled=()):
+    """Apply JSNES_PATCHES (except names in disabled). Returns the patched source and [(name, size change)];
+    exits with an error if a patch does not match its required count."""
+    applied = []
+    for name, pattern, replacement, count in JSNES_PATCHES:
+        if name in disabled:
+            continue
+        patched, n = re.subn(pattern, lambda m: replacement, jsnes_content, flags=re.S)
+        if n != count:
+            print(f"Error: jsnes patch {name} matched {n} times (expected {count})", file=sys.stderr)
+            sys.exit(1)
+        applied.append((name, len(patched) - len(jsnes_content)))
+        jsnes_content = patched
+    return jsnes_content, applied
+
+
+def profile_layout(name):
+    """Grid, cell geometry, font size, sampling block and ramp for a --profile preset."""
+    block = PROFILES[name]["block"]
+    cols, rows = 256 // block, 240 // block
+    char_width = SCREEN_W / cols
+    return {
+        "cols": cols,
+        "rows": rows,
+        "block": block,
+        "block_shift": block.bit_length() - 1,
+        "ramp": PROFILES[name]["ramp"],
+        "char_width": char_width,
+        "row_height": SCREEN_H / rows,
+        "font_size": 2 * char_width,
+    }
+
+
+def assign_object_ids(num_row_fields, object_streams=False, num_pickers=0, num_debug=NUM_DEBUG_FIELDS, linearized=False):
+    """Object numbers in file order: catalog, page tree, fonts, page, main script, then one block per field group
+    (ROM-picker buttons and their scripts for cartridge PDFs, plus the object stream and cross-reference stream with
+    --object-streams). linearized numbers what is not needed to show the page (page tree, main and ROM-picker scripts)
+    first and the first-page section, starting with the linearization dictionary and hint stream, after it, as the
+    two xref sections of LinearizedPdfWriter need."""
+    groups = [
+        ("catalog", 1),
+        ("pages", 1),
+        ("font_helv", 1),
+        ("font_cour", 1),
+        ("page", 1),
+        ("script_main", 1),
+        ("first_row", num_row_fields),
+        ("first_btn", NUM_BUTTONS),
+        ("first_debug", num_debug),
+        ("first_pick", num_pickers),
+        ("first_pick_script", num_pickers),
+        ("object_stream", 1 if object_streams else 0),
+        ("xref_stream", 1 if object_streams else 0),
+    ]
+    if linearized:
+        late = ("pages", "script_main", "first_pick_script")
+        groups = [g for g in groups if g[0] in late] + [("linearization", 1), ("hint_stream", 1)] + [g for g in groups if g[0] not in late]
+    ids = {}
+    next_id = 1
+    for key, count in groups:
+        ids[key] = next_id
+        next_id += count
+    ids["size"] = next_id
+    return ids
+
+
+def jsnes_palette(jsnes_content):
+    """Every RGB value jsnes writes to its framebuffer: the NTSC table under all 8 emphasis modes (as in
+    PPU.makeTables), plus 0 for clipped borders and the sprite-0 debug color."""
+    m = re.search(r"loadNTSCPalette:function\(\)\{this\.curTable=\[([\d,]+)\]", jsnes_content)
+    if not m:
+        return None
+    base = [int(v) for v in m.group(1).split(",")]
+    colors = {0, 5635925}
+    for emph in range(8):
+        r = g = b = 1.0
+        if emph & 1:
+            r = b = 0.75
+        if emph & 2:
+            r = g = 0.75
+        if emph & 4:
+            g = b = 0.75
+        for c in base:
+            colors.add(int((c >> 16 & 255) * r) << 16 | int((c >> 8 & 255) * g) << 8 | int((c & 255) * b))
+    return sorted(colors)
+
+
+def lum1000(rgb):
+    """Luminance scaled by 1000 (integer version of the legacy 0.299/0.587/0.114 weights)."""
+    return (rgb >> 16 & 255) * 299 + (rgb >> 8 & 255) * 587 + (rgb & 255) * 114
+
+
+def make_lut_renderer(jsnes_content, layout):
+    palette = jsnes_palette(jsnes_content)
+    if palette is None:
+        print("Error: NTSC palette not found in jsnes.min.js (use --renderer legacy)", file=sys.stderr)
         sys.exit(1)
+    # Smallest modulus that hashes every palette color to its own slot
+    mod = len(palette)
+    while len({c % mod for c in palette}) != len(palette):
+        mod += 1
+    ramp = layout["ramp"]
+    pixels_per_cell = layout["block"] ** 2
+    thresholds = [t for t, _ in ramp if t is not None]
+    step = reduce(gcd, thresholds) * pixels_per_cell * 1000
+    # Bucket k holds cell sums in (k*step, (k+1)*step]; every threshold is a bucket edge, so the mapping is exact
+    buckets = []
+    for k in range(255 * pixels_per_cell * 1000 // step + 1):
+        avg_floor = k * step // (pixels_per_cell * 1000)
+        buckets.append(next(ch for t, ch in ramp if t is None or avg_floor >= t))
+    return (
+        LUT_RENDERER.replace("BLOCK_SHIFT_VALUE", str(layout["block_shift"]))
+        .replace("LUM_MOD_VALUE", str(mod))
+        .replace("LUM_STEP_VALUE", str(step))
+        .replace("GLYPH_BUCKETS_VALUE", json.dumps(buckets))
+        .replace("PALETTE_RGB_VALUE", json.dumps(palette, separators=(",", ":")))
+        .replace("PALETTE_LUM_VALUE", json.dumps([lum1000(c) for c in palette], separators=(",", ":")))
+    )
 
-    with open(jsnes_path, "r", encoding="utf-8", errors="replace") as f:
-        jsnes_content = f.read()
-    # PDF viewers can mishandle the literal \x1a in embedded JS; use runtime header so validation matches our romStr
-    nes_literal = '.indexOf("NES' + '\x1a' + '")'
-    nes_runtime = '.indexOf(String.fromCharCode(78,69,83,26))'
-    if nes_literal in jsnes_content:
-        jsnes_content = jsnes_content.replace(nes_literal, nes_runtime, 1)
-    with open(rom_path, "rb") as f:
-        rom_b64 = b64encode(f.read()).decode("ascii")
 
-    ROM_CHUNK_SIZE = 2048
-    rom_chunks = [rom_b64[i : i + ROM_CHUNK_SIZE] for i in range(0, len(rom_b64), ROM_CHUNK_SIZE)]
-    # One line per chunk so the script does not hit PDF JS line-length limits
-    rom_chunks_js = "\n".join('romBase64 += "' + c + '";' for c in rom_chunks)
-    glue = GLUE_SCRIPT.replace("ROM_CHUNKS_PLACEHOLDER", rom_chunks_js)
-    wrapped_glue = "try { " + glue + " } catch(e) { if (typeof app !== 'undefined' && app.alert) app.alert('Error: ' + (e.message || e)); }"
-    main_script = jsnes_content + "\n" + wrapped_glue
+def make_renderer(kind, jsnes_content, layout):
+    if kind == "legacy":
+        return LEGACY_RENDERER
+    return make_lut_renderer(jsnes_content, layout)
 
-    field_list = []
-    fields_pdf = []
 
-    # 120 row text fields (screen) at top of page - names field_0..field_119 like DoomPDF for Chrome
-    for i in range(NUM_ROWS):
-        obj_id = FIRST_ROW_ID + i
-        y = SCREEN_TOP - (i + 1) * ROW_HEIGHT
-        field_list.append(f"{obj_id} 0 R")
-        fields_pdf.append(
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build nespdf.pdf from jsnes.min.js and mario.nes.")
+    parser.add_argument("--renderer", choices=RENDERERS, default="lut",
+                        help="framebuffer-to-text renderer: lut (table lookups, default) or legacy (per-pixel float luminance)")
+    parser.add_argument("--fps", type=int, default=TARGET_FPS, help="emulated frames per second (default %(default)s)")
+    parser.add_argument("--max-frameskip", type=int, default=MAX_FRAMESKIP,
+                        help="most frames emulated without display per tick when catching up (default %(default)s)")
+    parser.add_argument("--profile", choices=sorted(PROFILES, key=lambda k: PROFILES[k]["block"], reverse=True),
+                        default=DEFAULT_PROFILE, help="display grid / sampling preset (default %(default)s)")
+    parser.add_argument("--band", type=int, default=ROW_BAND,
+                        help="display rows per multiline screen field (default %(default)s = one single-line field per row)")
+    parser.add_argument("--field-budget", type=int, default=FIELD_BUDGET, metavar="N",
+                        help="most screen fields written per displayed frame, the rest are written on the next ones "
+                             "(lut renderer; default %(default)s = no limit)")
+    parser.add_argument("--rom-encoding", choices=sorted(ROM_DECODERS), default="base64",
+                        help="how the ROM is embedded in the script (default %(default)s)")
+    parser.add_argument("--disable-patch", action="append", default=[], metavar="NAME",
+                        choices=[name for name, _, _, _ in JSNES_PATCHES],
+                        help="skip one of the jsnes patches (repeatable): " + ", ".join(name for name, _, _, _ in JSNES_PATCHES))
+    parser.add_argument("--instrument", action="store_true",
+                        help="build in the hot-path profiler (frame / conversion / field-write timing in debug_5 and debug_6)")
+    parser.add_argument("--release", action="store_true",
+                        help="leave out the debug fields, the test pattern and the debug status code")
+    parser.add_argument("--no-minify", action="store_true", help="embed the glue script as written instead of minified")
+    parser.add_argument("--no-compress", action="store_true",
+                        help="write the JavaScript streams uncompressed with a classic xref table (for viewers that need it)")
+    parser.add_argument("--object-streams", action="store_true",
+                        help="pack the field and button dictionaries into a PDF 1.5 object stream with a cross-reference stream")
+    parser.add_argument("--rom", action="append", metavar="PATH",
+                        help="ROM to embed (default: mario.nes next to this script); repeat to build a cartridge PDF with "
+                             f"a ROM picker (up to {MAX_ROMS}) where each ROM is decoded only when picked")
+    parser.add_argument("--linearize", action="store_true",
+                        help="write a linearized (fast web view) PDF: page, fields and buttons first, the jsnes/ROM script after them")
+    parser.add_argument("-o", "--output", help="output PDF path (default: nespdf.pdf next to this script)")
+    parser.add_argument("--batch", metavar="DIR_OR_MANIFEST",
+                        help="build every *.nes in a directory, or every ROM listed in a manifest file (one path per line)")
+    parser.add_argument("--out-dir", help="batch output directory (default: next to each ROM)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="batch worker processes (default: CPU count)")
+    parser.add_argument("--cache-dir", help=f"build cache directory (default: {CACHE_DIR} next to this script)")
+    parser.add_argument("--cache-size", type=int, default=CACHE_MAX_MB, metavar="MB",
+                        help="build cache size cap; least recently used entries are removed beyond it (default %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="build everything from scratch without reading or writing the cache")
+    args = parser.parse_args(argv)
+    if args.fps < 1 or args.max_frameskip < 0:
+        parser.error("--fps must be >= 1 and --max-frameskip >= 0")
+    layout = profile_layout(args.profile)
+    if not 1 <= args.band <= layout["rows"]:
+        parser.error(f"--band must be between 1 and {layout['rows']}")
+    if args.renderer == "legacy" and args.profile != DEFAULT_PROFILE:
+        parser.error(f"--renderer legacy only supports --profile {DEFAULT_PROFILE}")
+    if args.field_budget < 0:
+        parser.error("--field-budget must be >= 0")
+    if args.renderer == "legacy" and args.field_budget:
+        parser.error("--field-budget needs --renderer lut")
+    if args.no_compress and args.object_streams:
+        parser.error("--object-streams needs compression (drop --no-compress)")
+    if args.release and args.instrument:
+        parser.error("--instrument reports in the debug fields, which --release leaves out")
+    if args.linearize and args.object_streams:
+        parser.error("--linearize writes xref tables and cannot be combined with --object-streams")
+    if args.cache_size < 0:
+        parser.error("--cache-size must be >= 0")
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be >= 1")
+    if args.batch and args.output:
+        parser.error("--output does not apply to --batch (use --out-dir)")
+    if args.batch and args.rom:
+        parser.error("--rom does not apply to --batch")
+    if args.rom and len(args.rom) > MAX_ROMS:
+        parser.error(f"at most {MAX_ROMS} --rom")
+    return args
+
+
+def make_fields(layout, band, ids, picker_labels=(), num_debug=NUM_DEBUG_FIELDS):
+    """Serialized screen, button, debug and ROM-picker field dictionaries as
+    {"rows": [...], "buttons": [...], "debug": [...], "pickers": [...]}."""
+    rows, cols, row_height = layout["rows"], layout["cols"], layout["row_height"]
+    page_id = ids["page"]
+    fields = {"rows": [], "buttons": [], "debug": [], "pickers": []}
+    # Screen text fields at top of page - names field_0..field_N like DoomPDF for Chrome; each covers band rows
+    for i in range(-(-rows // band)):
+        lines = min(band, rows - i * band)
+        y = SCREEN_TOP - (i * band + lines) * row_height
+        fields["rows"].append(
             make_text_field(
-                obj_id,
+                ids["first_row"] + i,
+                page_id,
                 f"field_{i}",
                 SCREEN_X,
                 y,
-                DISPLAY_COLS * CHAR_WIDTH,
-                ROW_HEIGHT,
+                cols * layout["char_width"],
+                lines * row_height,
                 with_border_style=True,
                 use_monospace=True,
+                lines=lines,
+                leading=row_height if lines > 1 else None,
+                font_size=layout["font_size"],
+                max_len=max(256, lines * (cols + 1)),
             )
         )
-
-    # Button script streams + buttons (NES layout positions). Run button gets /AA/U like DoomPDF.
-    for i, (name, label, script_body) in enumerate(BUTTONS):
-        script_id = FIRST_BTN_SCRIPT_ID + i
-        btn_id = FIRST_BTN_ID + i
-        field_list.append(f"{btn_id} 0 R")
-        fields_pdf.append(make_script_stream(script_id, script_body))
+    # Buttons (NES layout positions). Run button gets /AA/U like DoomPDF.
+    for i, (name, label, _) in enumerate(BUTTONS):
         bx, by = BTN_POSITIONS[i]
-        fields_pdf.append(make_button(btn_id, name, label, script_id, bx, by, BTN_SIZE, BTN_SIZE, add_aa_u=(i == 0)))
-
-    # Debug fields (top-right): debug_0=status, debug_1=run/rom, debug_2=frames, debug_3=last btn
+        action = BUTTON_ACTION.replace("INDEX", str(i))
+        fields["buttons"].append(make_button(ids["first_btn"] + i, page_id, name, label, action, bx, by, BTN_SIZE, BTN_SIZE, add_aa_u=(i == 0)))
+    # Debug fields (top-right): debug_0=status, debug_1=run/rom, debug_2=frames, debug_3=last btn, debug_4=pacing,
+    # debug_5..6=profiler (--instrument)
     DEBUG_X, DEBUG_Y0, DEBUG_W, DEBUG_H = 380, 755, 200, 10
-    for i in range(NUM_DEBUG_FIELDS):
-        oid = DEBUG_FIELD_IDS[i]
-        field_list.append(f"{oid} 0 R")
-        fields_pdf.append(
-            make_text_field(oid, f"debug_{i}", DEBUG_X, DEBUG_Y0 - i * 12, DEBUG_W, DEBUG_H, default_val=("[debug " + str(i) + "]"))
+    for i in range(num_debug):
+        fields["debug"].append(
+            make_text_field(ids["first_debug"] + i, page_id, f"debug_{i}", DEBUG_X, DEBUG_Y0 - i * 12, DEBUG_W, DEBUG_H, default_val=("[debug " + str(i) + "]"))
+        )
+    # ROM picker (cartridge PDFs): rom_0..rom_N, labelled with the ROM file names
+    for i, label in enumerate(picker_labels):
+        px = ROM_PICKER_X + (i % ROM_PICKER_COLS) * (ROM_PICKER_W + ROM_PICKER_GAP)
+        py = ROM_PICKER_Y - (i // ROM_PICKER_COLS) * (ROM_PICKER_H + ROM_PICKER_GAP)
+        fields["pickers"].append(
+            make_button(ids["first_pick"] + i, page_id, f"rom_{i}", label, ids["first_pick_script"] + i, px, py, ROM_PICKER_W, ROM_PICKER_H)
         )
+    return fields
+
+
+def select_lines(js, tag, keep):
+    """Keep the lines ending in //<tag> (without the tag) or remove them."""
+    if keep:
+        return js.replace(" //" + tag + "\n", "\n")
+    return re.sub(r"^.*//" + tag + r"\n", "", js, flags=re.M)
+
+
+def configure_glue(renderer, instrument=False, release=False):
+    """GLUE_SCRIPT with the renderer inserted and the optional parts of both compiled in or left out entirely: the
+    hot-path profiler (PROFILER_SCRIPT and //PROF lines) with instrument; the test pattern and debug plumbing
+    (TEST_PATTERN_SCRIPT and //DEBUG lines, with //RELEASE lines as their stand-ins) unless release."""
+    glue = GLUE_SCRIPT.replace("RENDERER_PLACEHOLDER", renderer)
+    glue = glue.replace("PROFILER_PLACEHOLDER\n", PROFILER_SCRIPT if instrument else "")
+    glue = glue.replace("TEST_PATTERN_PLACEHOLDER\n", "" if release else TEST_PATTERN_SCRIPT)
+    glue = select_lines(glue, "PROF", instrument)
+    glue = select_lines(glue, "DEBUG", not release)
+    return select_lines(glue, "RELEASE", release)
 
-    field_list_str = " ".join(field_list)
-    fields_blob = "\n".join(fields_pdf)
 
-    catalog = f"""1 0 obj
+# Characters next to which whitespace is never needed in JS (outside strings)
+JS_PUNCTUATION = set("{}()[];,=<>!&|?:+-*/%^~.")
+
+
+def minify_js(js):
+    """Conservative minifier for the glue: removes comments, indentation, blank lines and spaces next to punctuation,
+    outside string literals. Line breaks are kept so automatic semicolon insertion sees the same statements; a space
+    between two + or two - stays. The glue has no regex literals, which this does not parse."""
+    out = []
+    i, n = 0, len(js)
+    while i < n:
+        c = js[i]
+        if c in "\"'":
+            j = i + 1
+            while js[j] != c:
+                j += 2 if js[j] == "\\" else 1
+            out.append(js[i : j + 1])
+            i = j + 1
+        elif js.startswith("//", i):
+            i = js.find("\n", i) if "\n" in js[i:] else n
+        elif js.startswith("/*", i):
+            i = js.index("*/", i) + 2
+        elif c in " \t\n":
+            j = i
+            while j < n and js[j] in " \t\n":
+                j += 1
+            prev = out[-1][-1] if out else "\n"
+            nxt = js[j] if j < n else "\n"
+            if "\n" in js[i:j]:
+                if prev != "\n" and j < n:
+                    out.append("\n")
+            elif not (prev in JS_PUNCTUATION or nxt in JS_PUNCTUATION or prev == "\n") or (prev in "+-" and nxt == prev):
+                out.append(" ")
+            i = j
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out)
+
+
+def rom_chunks_js(rom, encoding, var):
+    """ROM bytes as base64 or hex text appended to JS variable var, one `var += "...";` line per chunk so the script
+    does not hit PDF JS line-length limits."""
+    ROM_CHUNK_SIZE = 2048
+    rom_text = b64encode(rom).decode("ascii") if encoding == "base64" else rom.hex()
+    return "\n".join(var + ' += "' + rom_text[i : i + ROM_CHUNK_SIZE] + '";' for i in range(0, len(rom_text), ROM_CHUNK_SIZE))
+
+
+def write_pdf(jsnes_content, roms, out_path, args, cache):
+    """Generate the PDF into out_path; the renderer, script streams and field dictionaries come from cache.
+    roms: [(label, bytes)]. One ROM is embedded in the main script; several make a cartridge PDF where each ROM
+    lives in its picker button's script and is decoded only when picked."""
+    layout = profile_layout(args.profile)
+    compress = not args.no_compress
+    pickers = roms if len(roms) > 1 else []
+    rom_chunks = "" if pickers else rom_chunks_js(roms[0][1], args.rom_encoding, "romData")
+    # Cached without regard to --release / --instrument; configure_glue selects its tagged lines
+    renderer = cache.get_text("renderer", (jsnes_content, args.renderer, args.profile),
+                              lambda: make_renderer(args.renderer, jsnes_content, layout))
+    glue = (
+        configure_glue(renderer, args.instrument, args.release)
+        .replace("ROM_DECODER_PLACEHOLDER", ROM_DECODERS[args.rom_encoding])
+        .replace("DISPLAY_ROWS_VALUE", str(layout["rows"]))
+        .replace("DISPLAY_COLS_VALUE", str(layout["cols"]))
+        .replace("TARGET_FPS_VALUE", str(args.fps))
+        .replace("MAX_FRAMESKIP_VALUE", str(args.max_frameskip))
+        .replace("ROW_BAND_VALUE", str(args.band))
+        .replace("FIELD_BUDGET_VALUE", str(args.field_budget))
+        .replace("BUTTON_KEYS_VALUE", json.dumps([-1 if key is None else key for _, _, key in BUTTONS]))
+        .replace("BUTTON_LABELS_VALUE", json.dumps([label for _, label, _ in BUTTONS]))
+    )
+    # Minified before the ROM text goes in, which only adds string literals
+    if not args.no_minify:
+        glue = minify_js(glue)
+    glue = glue.replace("ROM_CHUNKS_PLACEHOLDER", rom_chunks)
+    wrapped_glue = "try { " + glue + " } catch(e) { if (typeof app !== 'undefined' && app.alert) app.alert('Error: ' + (e.message || e)); }"
+    main_script = "var openTime = Date.now();\n" + jsnes_content + "\n" + wrapped_glue
+
+    num_row_fields = -(-layout["rows"] // args.band)
+    num_debug = 0 if args.release else NUM_DEBUG_FIELDS + (PROFILER_DEBUG_FIELDS if args.instrument else 0)
+    ids = assign_object_ids(num_row_fields, args.object_streams, len(pickers), num_debug, args.linearize)
+    page_id = ids["page"]
+    field_ids = (
+        [ids["first_row"] + i for i in range(num_row_fields)]
+        + [ids["first_btn"] + i for i in range(NUM_BUTTONS)]
+        + [ids["first_debug"] + i for i in range(num_debug)]
+        + [ids["first_pick"] + i for i in range(len(pickers))]
+    )
+    field_list_str = " ".join(f"{n} 0 R" for n in field_ids)
+
+    fonts_ref = f"/Helv {ids['font_helv']} 0 R /Cour {ids['font_cour']} 0 R"
+    catalog = f"""{ids['catalog']} 0 obj
 <<
-/AcroForm << /Fields [ {field_list_str} ] /DR << /Font << /Helv 10 0 R /Cour 11 0 R >> >> /DA (/Helv 8 Tf 0 g) >>
-/OpenAction << /JS {SCRIPT_MAIN_ID} 0 R /S /JavaScript >>
-/Pages 2 0 R
+/AcroForm << /Fields [ {field_list_str} ] /DR << /Font << {fonts_ref} >> >> /DA (/Helv 8 Tf 0 g) >>
+/OpenAction << /JS {ids['script_main']} 0 R /S /JavaScript >>
+/Pages {ids['pages']} 0 R
 /Type /Catalog
 >>
 endobj
 """
 
-    pages = f"""2 0 obj
+    pages = f"""{ids['pages']} 0 obj
 <<
 /Count 1
-/Kids [ {PAGE_ID} 0 R ]
+/Kids [ {page_id} 0 R ]
 /Type /Pages
 >>
 endobj
 """
 
-    page = f"""16 0 obj
+    page = f"""{page_id} 0 obj
 <<
-/AA << /O << /JS {SCRIPT_MAIN_ID} 0 R /S /JavaScript >> >>
+/AA << /O << /JS {ids['script_main']} 0 R /S /JavaScript >> >>
 /Annots [ {field_list_str} ]
 /MediaBox [ 0 0 {PAGE_W} {PAGE_H} ]
-/Parent 2 0 R
-/Resources << /Font << /Helv 10 0 R /Cour 11 0 R >> >>
+/Parent {ids['pages']} 0 R
+/Resources << /Font << {fonts_ref} >> >>
 /Type /Page
 >>
 endobj
 """
 
-    font = """10 0 obj
+    font_helv = f"""{ids['font_helv']} 0 obj
 <<
 /BaseFont /Helvetica
 /Subtype /Type1
 /Type /Font
 >>
 endobj
-11 0 obj
+"""
+    font_cour = f"""{ids['font_cour']} 0 obj
 <<
 /BaseFont /Courier
 /Subtype /Type1
@@ -391,40 +1233,187 @@ endobj
 endobj
 """
 
-    main_script_obj = make_script_stream(SCRIPT_MAIN_ID, main_script)
+    with open(out_path, "wb") as f:
+        pdf = LinearizedPdfWriter(f, ids, binary=compress) if args.linearize else PdfWriter(f, binary=compress)
+        for obj in (catalog, pages, font_helv, font_cour, page):
+            pdf.write_object(obj)
+
+        def stream(obj_id, content):
+            return cache.get("stream", (str(obj_id), content, str(compress)), lambda: make_script_stream(obj_id, content, compress))
 
-    out_path = os.path.join(base, "nespdf.pdf")
-    body_ordered = (
-        catalog + pages + font + page + main_script_obj
-        + "".join(fields_pdf)
-    )
-    header = b"%PDF-1.6\n\n"
-    body_bytes = body_ordered.encode("utf-8")
-    offsets = {}
-    for m in re.finditer(rb"(\d+) 0 obj", body_bytes):
-        obj_num = int(m.group(1))
-        offsets[obj_num] = len(header) + m.start()
-    max_obj = max(offsets.keys())
-    size = max_obj + 1
-    xref_lines = ["xref", "0 %d" % size]
-    xref_lines.append("0000000000 65535 f ")
-    for i in range(1, max_obj + 1):
-        if i in offsets:
-            xref_lines.append("%010d 00000 n " % offsets[i])
+        pdf.write_object(stream(ids["script_main"], main_script))
+
+        # Field and button dictionaries go straight to the file, or are collected for the object stream
+        labels = [label for label, _ in pickers]
+        fields = cache.get_json(
+            "fields",
+            (args.profile, str(args.band), json.dumps(ids, sort_keys=True), json.dumps(labels)),
+            lambda: make_fields(layout, args.band, ids, labels, num_debug),
+        )
+        fields_pdf = []
+        add_field = fields_pdf.append if args.object_streams else pdf.write_object
+        for obj in fields["rows"] + fields["buttons"] + fields["debug"]:
+            add_field(obj)
+        # Cartridge: each picker's script carries its ROM and hands it to selectRom
+        for i, (label, rom) in enumerate(pickers):
+            pick_script = (
+                'var d = "";\n' + rom_chunks_js(rom, args.rom_encoding, "d") + "\n"
+                + f"var S=(typeof app!=='undefined'&&app.nespdf_selectRom)||globalThis.selectRom; if(S) S({i}, {json.dumps(label)}, d);"
+            )
+            pdf.write_object(stream(ids["first_pick_script"] + i, pick_script))
+            add_field(fields["pickers"][i])
+
+        if args.object_streams:
+            pdf.write_object_stream(ids["object_stream"], fields_pdf)
+            pdf.finish(ids["catalog"], xref_stream_id=ids["xref_stream"])
         else:
-            xref_lines.append("0000000000 00000 f ")
-    xref_block = "\n".join(xref_lines) + "\n"
-    startxref_val = len(header) + len(body_bytes)
-    trailer_block = "trailer\n<<\n/Root 1 0 R\n/Size %d\n>>\nstartxref\n%d\n%%%%EOF\n" % (
-        size,
-        startxref_val,
+            pdf.finish(ids["catalog"])
+
+
+# Options that only say where and how to build, not what goes into the PDF (left out of the output cache key)
+BUILD_ONLY_OPTIONS = ("rom", "output", "batch", "out_dir", "jobs", "cache_dir", "cache_size", "no_cache")
+
+
+def load_rom(path):
+    """(picker label, ROM bytes) for an iNES file; raises ValueError if the header is missing."""
+    with open(path, "rb") as f:
+        rom = f.read()
+    if not rom.startswith(b"NES\x1a"):
+        raise ValueError("not an iNES ROM (missing NES\\x1a header)")
+    label = os.path.splitext(os.path.basename(path))[0].encode("ascii", "replace").decode("ascii")
+    return label[:14], rom
+
+
+def build(jsnes_content, roms, out_path, args, cache=None):
+    """Write one PDF for [(label, ROM bytes)] (see load_rom; several make a cartridge PDF) using already-patched
+    jsnes source. With a BuildCache, an identical earlier build is copied from the cache, otherwise unchanged parts
+    (renderer, streams, fields) are reused."""
+    cache = cache or BuildCache(None)
+    options = json.dumps({k: v for k, v in sorted(vars(args).items()) if k not in BUILD_ONLY_OPTIONS})
+    parts = [jsnes_content, options] + [part for rom in roms for part in rom]
+    cache.get_file("pdf", parts, out_path, lambda path: write_pdf(jsnes_content, roms, path, args, cache))
+
+
+def batch_roms(source, out_dir=None):
+    """(rom path, pdf path) pairs for a directory of *.nes files or a manifest listing one ROM path per line
+    (relative to the manifest; blank lines and # comments ignored)."""
+    if os.path.isdir(source):
+        roms = [os.path.join(source, n) for n in sorted(os.listdir(source)) if n.lower().endswith(".nes")]
+    else:
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f]
+        roms = [os.path.join(base, line) for line in lines if line and not line.startswith("#")]
+    jobs = []
+    for rom_path in roms:
+        stem = os.path.splitext(os.path.basename(rom_path))[0]
+        jobs.append((rom_path, os.path.join(out_dir or os.path.dirname(rom_path), stem + ".pdf")))
+    return jobs
+
+
+# Patched jsnes source and build cache, set up in each batch worker once by the pool initializer instead of with
+# every job
+_batch_jsnes = None
+_batch_cache = None
+
+
+def _init_batch_worker(jsnes_content, cache_root, cache_max_bytes):
+    global _batch_jsnes, _batch_cache
+    _batch_jsnes = jsnes_content
+    _batch_cache = BuildCache(cache_root, cache_max_bytes)
+
+
+def _batch_job(rom_path, out_path, args):
+    """Build one batch entry; returns (seconds, output size, error message or None)."""
+    t0 = time.perf_counter()
+    try:
+        build(_batch_jsnes, [load_rom(rom_path)], out_path, args, _batch_cache)
+        return time.perf_counter() - t0, os.path.getsize(out_path), None
+    except (OSError, ValueError) as e:
+        return time.perf_counter() - t0, 0, str(e)
+
+
+def run_batch(jsnes_content, jobs, args, cache):
+    """Build all (rom, pdf) jobs in a process pool and print a per-file summary. Returns the number of failures."""
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    t0 = time.perf_counter()
+    results = {}
+    initargs = (jsnes_content, cache.root, cache.max_bytes)
+    with ProcessPoolExecutor(max_workers=args.jobs, initializer=_init_batch_worker, initargs=initargs) as pool:
+        futures = {pool.submit(_batch_job, rom_path, out_path, args): (rom_path, out_path) for rom_path, out_path in jobs}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    failures = 0
+    for rom_path, out_path in jobs:
+        seconds, size, error = results[(rom_path, out_path)]
+        if error:
+            failures += 1
+            print(f"FAIL {rom_path}: {error}")
+        else:
+            print(f"ok   {out_path}  {seconds * 1000:7.0f} ms  {size:9d} bytes")
+    print(f"{len(jobs) - failures}/{len(jobs)} built in {time.perf_counter() - t0:.2f} s, {failures} failed")
+    return failures
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    base = os.path.dirname(os.path.abspath(__file__))
+    jsnes_path = os.path.join(base, "jsnes.min.js")
+    rom_paths = args.rom or [os.path.join(base, "mario.nes")]
+
+    if not os.path.isfile(jsnes_path):
+        print("Error: jsnes.min.js not found", file=sys.stderr)
+        sys.exit(1)
+    for rom_path in [] if args.batch else rom_paths:
+        if not os.path.isfile(rom_path):
+            print(f"Error: {rom_path} not found", file=sys.stderr)
+            sys.exit(1)
+
+    cache = BuildCache(None if args.no_cache else args.cache_dir or os.path.join(base, CACHE_DIR), args.cache_size << 20)
+
+    # jsnes is read and patched once, also for a whole batch
+    with open(jsnes_path, "r", encoding="utf-8", errors="replace") as f:
+        jsnes_source = f.read()
+    jsnes_content, applied = cache.get_json(
+        "engine", (jsnes_source, "\n".join(args.disable_patch)), lambda: apply_jsnes_patches(jsnes_source, args.disable_patch)
     )
-    with open(out_path, "wb") as f:
-        f.write(header)
-        f.write(body_bytes)
-        f.write(xref_block.encode())
-        f.write(trailer_block.encode())
+    for name, delta in applied:
+        print(f"jsnes patch {name}: {delta:+d} bytes")
+
+    if args.batch:
+        if not os.path.exists(args.batch):
+            print(f"Error: {args.batch} not found", file=sys.stderr)
+            sys.exit(1)
+        jobs = batch_roms(args.batch, args.out_dir)
+        if not jobs:
+            print(f"Error: no ROMs in {args.batch}", file=sys.stderr)
+            sys.exit(1)
+        # Two entries with one output path (same file name under --out-dir, or a ROM listed twice) would have two
+        # workers writing the same PDF
+        outputs = {}
+        for rom_path, out_path in jobs:
+            key = os.path.normcase(os.path.abspath(out_path))
+            if key in outputs:
+                print(f"Error: {outputs[key]} and {rom_path} would both be written to {out_path}", file=sys.stderr)
+                sys.exit(1)
+            outputs[key] = rom_path
+        failures = run_batch(jsnes_content, jobs, args, cache)
+        cache.trim()
+        sys.exit(1 if failures else 0)
 
+    roms = []
+    for rom_path in rom_paths:
+        try:
+            roms.append(load_rom(rom_path))
+        except ValueError as e:
+            print(f"Error: {rom_path}: {e}", file=sys.stderr)
+            sys.exit(1)
+    out_path = args.output or os.path.join(base, "nespdf.pdf")
+    build(jsnes_content, roms, out_path, args, cache)
+    cache.trim()
+    if cache.root is not None:
+        print(f"cache: {cache.hits} hit(s), {cache.misses} miss(es)")
     print("Wrote", out_path)
 
 
@@ -1,16 +1,23 @@
+import re
+
+from build_pdf import JSNES_PATCHES
+
 with open("jsnes.min.js", "r", encoding="utf-8", errors="replace") as f:
     s = f.read()
-# Pattern as in source: indexOf("NES\x1a") -> in file: indexOf("NES" + char(26) + ")
-needle = '.indexOf("NES' + '\x1a' + '")'
-found = needle in s
-print("Pattern found:", found)
-if found:
-    i = s.index(needle)
-    print("Context:", repr(s[i:i+60]))
-else:
-    # try finding "NES" and see what follows
-    j = s.find('indexOf("NES')
-    if j >= 0:
-        print("Alt context:", repr(s[j:j+60]))
-        for k in range(min(10, len(s)-j)):
-            print(k, ord(s[j+k]) if j+k < len(s) else None)
+# Every patch in build_pdf.JSNES_PATCHES must match its required count, or the build fails
+ok = True
+for name, pattern, replacement, count in JSNES_PATCHES:
+    matches = list(re.finditer(pattern, s, flags=re.S))
+    print(f"{name}: {len(matches)} match(es), expected {count}")
+    if len(matches) != count:
+        ok = False
+    for m in matches[:3]:
+        print("  Context:", repr(s[m.start():m.start() + 60]))
+    if name == "nes-header" and not matches:
+        # try finding "NES" and see what follows
+        j = s.find('indexOf("NES')
+        if j >= 0:
+            print("Alt context:", repr(s[j:j+60]))
+            for k in range(min(10, len(s)-j)):
+                print(k, ord(s[j+k]) if j+k < len(s) else None)
+print("All patches match:", ok)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Reference framebuffer-to-text renderer for nespdf, outside the PDF.
+Does what the lut renderer in build_pdf.py does: each cell of a --profile grid sums the integer luminance
+(299r + 587g + 114b) of its block x block pixels, and the sum picks the first ramp glyph whose threshold it is above.
+Runs over recorded 256x240 framebuffer dumps (raw 0xRRGGBB pixels, 4 bytes little-endian each, frames back to back;
+benchmark.py --record writes them), vectorized with NumPy when it is installed and in plain Python otherwise.
+Run: python reference_renderer.py frames.fb [--profile 64x60] [--show N]
+"""
+from array import array
+import argparse
+import sys
+import time
+
+from build_pdf import DEFAULT_PROFILE, PROFILES, lum1000, profile_layout
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FRAME_PIXELS = 256 * 240
+FRAME_BYTES = FRAME_PIXELS * 4
+
+
+def read_frames(path):
+    """Framebuffers of a dump file, one array of FRAME_PIXELS ints per frame."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) % FRAME_BYTES:
+        raise ValueError(f"{path}: size is not a multiple of one 256x240 frame ({FRAME_BYTES} bytes)")
+    frames = []
+    for i in range(0, len(data), FRAME_BYTES):
+        fb = array("I")
+        fb.frombytes(data[i : i + FRAME_BYTES])
+        if sys.byteorder == "big":
+            fb.byteswap()
+        frames.append(fb)
+    return frames
+
+
+def cell_limits(layout):
+    """Ramp thresholds as cell luminance sums: [(limit, glyph)] brightest first, and the fallback glyph."""
+    pixels_per_cell = layout["block"] ** 2
+    ramp = layout["ramp"]
+    return [(t * pixels_per_cell * 1000, ch) for t, ch in ramp if t is not None], ramp[-1][1]
+
+
+class _Luminance(dict):
+    """lum1000 per color, computed on first use (a frame has few distinct colors)."""
+
+    def __missing__(self, rgb):
+        value = self[rgb] = lum1000(rgb)
+        return value
+
+
+_LUM = _Luminance()
+
+
+def render_python(fb, layout):
+    """Display rows (strings) for one framebuffer, plain Python."""
+    block, cols = layout["block"], layout["cols"]
+    limits, fallback = cell_limits(layout)
+    out = []
+    for row in range(layout["rows"]):
+        acc = [0] * cols
+        for y in range(row * block, row * block + block):
+            lums = list(map(_LUM.__getitem__, fb[y * 256 : y * 256 + 256]))
+            if block == 1:
+                acc = [a + l for a, l in zip(acc, lums)]
+            else:
+                acc = [a + sum(lums[x : x + block]) for a, x in zip(acc, range(0, 256, block))]
+        out.append("".join(next((ch for limit, ch in limits if s > limit), fallback) for s in acc))
+    return out
+
+
+def render_numpy(fb, layout):
+    """Display rows (strings) for one framebuffer, NumPy."""
+    block = layout["block"]
+    limits, fallback = cell_limits(layout)
+    px = np.asarray(fb, dtype=np.int64).reshape(240, 256)
+    lum = (px >> 16 & 255) * 299 + (px >> 8 & 255) * 587 + (px & 255) * 114
+    sums = lum.reshape(layout["rows"], block, layout["cols"], block).sum(axis=(1, 3))
+    # Thresholds are descending, so the glyph index is the number of them the sum does not exceed
+    index = (sums[..., None] <= np.array([limit for limit, _ in limits])).sum(axis=-1)
+    glyphs = np.array([ch for _, ch in limits] + [fallback])
+    return ["".join(r) for r in glyphs[index]]
+
+
+def render_frame(fb, layout, use_numpy=None):
+    """Display rows for one framebuffer; use_numpy None = NumPy when installed."""
+    if use_numpy is None:
+        use_numpy = np is not None
+    return render_numpy(fb, layout) if use_numpy else render_python(fb, layout)
+
+
+def render_frames(frames, layout, use_numpy=None):
+    """Render a frame sequence like the lut renderer does in the viewer. Returns (rows per frame, stats), where stats
+    has rows_converted / rows_written per frame: rows whose source pixels changed since the previous frame, and rows
+    whose text changed (the ones that cost a field write)."""
+    block = layout["block"]
+    span = 256 * block
+    prev_fb, prev_rows = None, None
+    out, converted, written = [], [], []
+    for fb in frames:
+        rows = render_frame(fb, layout, use_numpy)
+        if prev_fb is None:
+            converted.append(layout["rows"])
+            written.append(layout["rows"])
+        else:
+            converted.append(sum(fb[r * span : r * span + span] != prev_fb[r * span : r * span + span] for r in range(layout["rows"])))
+            written.append(sum(a != b for a, b in zip(rows, prev_rows)))
+        prev_fb, prev_rows = fb, rows
+        out.append(rows)
+    return out, {"rows_converted": converted, "rows_written": written}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render recorded framebuffer dumps with the reference renderer.")
+    parser.add_argument("dump", help="framebuffer dump (raw 256x240 0xRRGGBB frames, 4 bytes little-endian per pixel)")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE, help="display grid (default %(default)s)")
+    parser.add_argument("--no-numpy", action="store_true", help="use the plain Python renderer even if NumPy is installed")
+    parser.add_argument("--show", type=int, metavar="N", help="print the text of frame N")
+    args = parser.parse_args(argv)
+    try:
+        frames = read_frames(args.dump)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    layout = profile_layout(args.profile)
+    use_numpy = np is not None and not args.no_numpy
+    t0 = time.perf_counter()
+    rendered, stats = render_frames(frames, layout, use_numpy)
+    seconds = time.perf_counter() - t0
+    n = len(frames)
+    print(f"{n} frames, {args.profile}, {'numpy' if use_numpy else 'python'}: {seconds * 1000 / max(n, 1):.2f} ms/frame, "
+          f"{n / seconds if seconds else 0:.0f} frames/s")
+    print(f"rows converted/frame {sum(stats['rows_converted']) / max(n, 1):.1f}, written/frame {sum(stats['rows_written']) / max(n, 1):.1f}")
+    if args.show is not None:
+        print("\n".join(rendered[args.show]))
+
+
+if __name__ == "__main__":
+    main()